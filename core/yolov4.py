@@ -160,13 +160,15 @@ def YOLOv3_tiny(input_layer, NUM_CLASS):
 
     return [conv_mbbox, conv_lbbox]
 
-def decode(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE=[1,1,1], FRAMEWORK='tf'):
+def decode(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE=[1,1,1], FRAMEWORK='tf', CLASS_IDS=None):
+    # if CLASS_IDS is set, only the probabilities of these classes are computed
+    # and class index k of the output refers to class CLASS_IDS[k]
     if FRAMEWORK == 'trt':
-        return decode_trt(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE)
+        return decode_trt(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE, CLASS_IDS=CLASS_IDS)
     elif FRAMEWORK == 'tflite':
-        return decode_tflite(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE)
+        return decode_tflite(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE, CLASS_IDS=CLASS_IDS)
     else:
-        return decode_tf(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE)
+        return decode_tf(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=i, XYSCALE=XYSCALE, CLASS_IDS=CLASS_IDS)
 
 def decode_train(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1, 1, 1]):
     conv_output = tf.reshape(conv_output,
@@ -191,13 +193,16 @@ def decode_train(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYS
 
     return tf.concat([pred_xywh, pred_conf, pred_prob], axis=-1)
 
-def decode_tf(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1, 1, 1]):
+def decode_tf(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1, 1, 1], CLASS_IDS=None):
     batch_size = tf.shape(conv_output)[0]
     conv_output = tf.reshape(conv_output,
                              (batch_size, output_size, output_size, 3, 5 + NUM_CLASS))
 
     conv_raw_dxdy, conv_raw_dwdh, conv_raw_conf, conv_raw_prob = tf.split(conv_output, (2, 2, 1, NUM_CLASS),
                                                                           axis=-1)
+    if CLASS_IDS is not None:
+        conv_raw_prob = tf.gather(conv_raw_prob, CLASS_IDS, axis=-1)
+        NUM_CLASS = len(CLASS_IDS)
 
     xy_grid = tf.meshgrid(tf.range(output_size), tf.range(output_size))
     xy_grid = tf.expand_dims(tf.stack(xy_grid, axis=-1), axis=2)  # [gx, gy, 1, 2]
@@ -220,13 +225,18 @@ def decode_tf(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCAL
     return pred_xywh, pred_prob
     # return tf.concat([pred_xywh, pred_conf, pred_prob], axis=-1)
 
-def decode_tflite(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1,1,1]):
+def decode_tflite(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1,1,1], CLASS_IDS=None):
     conv_raw_dxdy_0, conv_raw_dwdh_0, conv_raw_score_0,\
     conv_raw_dxdy_1, conv_raw_dwdh_1, conv_raw_score_1,\
     conv_raw_dxdy_2, conv_raw_dwdh_2, conv_raw_score_2 = tf.split(conv_output, (2, 2, 1+NUM_CLASS, 2, 2, 1+NUM_CLASS,
                                                                                 2, 2, 1+NUM_CLASS), axis=-1)
 
     conv_raw_score = [conv_raw_score_0, conv_raw_score_1, conv_raw_score_2]
+    if CLASS_IDS is not None:
+        # keep the objectness channel and the channels of the kept classes
+        score_channels = [0] + [1 + class_id for class_id in CLASS_IDS]
+        conv_raw_score = [tf.gather(score, score_channels, axis=-1) for score in conv_raw_score]
+        NUM_CLASS = len(CLASS_IDS)
     for idx, score in enumerate(conv_raw_score):
         score = tf.sigmoid(score)
         score = score[:, :, :, 0:1] * score[:, :, :, 1:]
@@ -254,11 +264,14 @@ def decode_tflite(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XY
     return pred_xywh, pred_prob
     # return tf.concat([pred_xywh, pred_conf, pred_prob], axis=-1)
 
-def decode_trt(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1,1,1]):
+def decode_trt(conv_output, output_size, NUM_CLASS, STRIDES, ANCHORS, i=0, XYSCALE=[1,1,1], CLASS_IDS=None):
     batch_size = tf.shape(conv_output)[0]
     conv_output = tf.reshape(conv_output, (batch_size, output_size, output_size, 3, 5 + NUM_CLASS))
 
     conv_raw_dxdy, conv_raw_dwdh, conv_raw_conf, conv_raw_prob = tf.split(conv_output, (2, 2, 1, NUM_CLASS), axis=-1)
+    if CLASS_IDS is not None:
+        conv_raw_prob = tf.gather(conv_raw_prob, CLASS_IDS, axis=-1)
+        NUM_CLASS = len(CLASS_IDS)
 
     xy_grid = tf.meshgrid(tf.range(output_size), tf.range(output_size))
     xy_grid = tf.expand_dims(tf.stack(xy_grid, axis=-1), axis=2)  # [gx, gy, 1, 2]
@@ -298,7 +311,14 @@ def filter_boxes(box_xywh, scores, score_threshold=0.4, input_shape = tf.constan
     class_boxes = tf.reshape(class_boxes, [tf.shape(scores)[0], -1, tf.shape(class_boxes)[-1]])
     pred_conf = tf.reshape(pred_conf, [tf.shape(scores)[0], -1, tf.shape(pred_conf)[-1]])
 
-    box_xy, box_wh = tf.split(class_boxes, (2, 2), axis=-1)
+    boxes = xywh_to_yxyx(class_boxes, input_shape)
+    # return tf.concat([boxes, pred_conf], axis=-1)
+    return (boxes, pred_conf)
+
+def xywh_to_yxyx(box_xywh, input_shape):
+    # center x, center y, width, height in input pixels ---> normalized
+    # y_min, x_min, y_max, x_max
+    box_xy, box_wh = tf.split(box_xywh, (2, 2), axis=-1)
 
     input_shape = tf.cast(input_shape, dtype=tf.float32)
 
@@ -307,14 +327,55 @@ def filter_boxes(box_xywh, scores, score_threshold=0.4, input_shape = tf.constan
 
     box_mins = (box_yx - (box_hw / 2.)) / input_shape
     box_maxes = (box_yx + (box_hw / 2.)) / input_shape
-    boxes = tf.concat([
+    return tf.concat([
         box_mins[..., 0:1],  # y_min
         box_mins[..., 1:2],  # x_min
         box_maxes[..., 0:1],  # y_max
         box_maxes[..., 1:2]  # x_max
     ], axis=-1)
-    # return tf.concat([boxes, pred_conf], axis=-1)
-    return (boxes, pred_conf)
+
+def filter_boxes_top_k(box_xywh, scores, score_threshold=0.4, input_shape=tf.constant([416,416]), top_k=1000):
+    # batch-safe variant of filter_boxes: keeps the top_k candidates of every
+    # image by max class score. candidates below the score threshold are padding
+    # with zero scores; valid_counts holds the number of leading valid
+    # candidates per image
+    scores_max = tf.math.reduce_max(scores, axis=-1)
+    if scores.shape[1] is not None:
+        top_k = min(top_k, scores.shape[1])
+
+    top_scores, indices = tf.math.top_k(scores_max, k=top_k, sorted=True)
+    valid = top_scores >= score_threshold
+    valid_counts = tf.reduce_sum(tf.cast(valid, tf.int32), axis=-1)
+    class_boxes = tf.gather(box_xywh, indices, batch_dims=1)
+    pred_conf = tf.gather(scores, indices, batch_dims=1) * tf.cast(valid, scores.dtype)[..., tf.newaxis]
+
+    boxes = xywh_to_yxyx(class_boxes, input_shape)
+    return boxes, pred_conf, valid_counts
+
+def combined_nms(box_xywh, scores, input_shape=tf.constant([416,416]), score_threshold=0.4, iou_threshold=0.45,
+                 max_total_size=50, class_ids=None, top_k=None):
+    # class-wise non-maxima suppression of a batch of decoded predictions, to be
+    # part of an exported model. if the model has been decoded for a subset of
+    # classes, class_ids maps the subset back to the original class indices. if
+    # top_k is set, only the top_k candidates of every image enter the
+    # suppression. returns padded boxes (normalized y_min, x_min, y_max, x_max),
+    # scores, classes and valid detections per image
+    if top_k:
+        boxes, scores, _ = filter_boxes_top_k(box_xywh, scores, score_threshold, input_shape, top_k)
+    else:
+        boxes = xywh_to_yxyx(box_xywh, input_shape)
+
+    boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
+        boxes=tf.expand_dims(boxes, axis=2),
+        scores=scores,
+        max_output_size_per_class=max_total_size,
+        max_total_size=max_total_size,
+        iou_threshold=iou_threshold,
+        score_threshold=score_threshold
+    )
+    if class_ids is not None:
+        classes = tf.gather(tf.constant(class_ids, dtype=classes.dtype), tf.cast(classes, tf.int32))
+    return boxes, scores, classes, valid_detections
 
 
 def compute_loss(pred, conv, label, bboxes, STRIDES, NUM_CLASS, IOU_LOSS_THRESH, i=0):
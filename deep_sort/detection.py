@@ -12,8 +12,9 @@ class Detection(object):
         Bounding box in format `(x, y, w, h)`.
     confidence : float
         Detector confidence score.
-    feature : array_like
+    feature : array_like | NoneType
         A feature vector that describes the object contained in this image.
+        May be None if the feature is computed on demand by the tracker.
 
     Attributes
     ----------
@@ -32,7 +33,9 @@ class Detection(object):
         self.tlwh = np.asarray(tlwh, dtype=np.float)
         self.confidence = float(confidence)
         self.class_name = class_name
-        self.feature = np.asarray(feature, dtype=np.float32)
+        self.feature = None
+        if feature is not None:
+            self.feature = np.asarray(feature, dtype=np.float32)
 
     def get_class(self):
         return self.class_name
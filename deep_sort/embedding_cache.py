@@ -0,0 +1,161 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+from . import iou_matching
+
+
+class EmbeddingCache(object):
+    """
+    A per-track cache of the most recently encoded appearance feature.
+
+    For every track the cache remembers the bounding box of the last crop
+    that was passed through the appearance encoder together with the
+    resulting feature. A detection that is associated with the track and
+    whose box is nearly identical to the cached box shows nearly the same
+    image content, so the cached feature is reused instead of running the
+    encoder again. A feature is only ever reused for a detection of the track
+    it has been computed for. Cached features are reused for at most
+    `max_age` frames after they have been computed.
+
+    Parameters
+    ----------
+    min_iou : Optional[float]
+        A cached feature is only reused if the intersection over union
+        between the detection and the cached box is at least this value.
+        Disabled if None.
+    max_pixel_delta : Optional[float]
+        A cached feature is only reused if no coordinate of the detection
+        `(min x, min y, max x, max y)` differs from the cached box by more
+        than this number of pixels. Disabled if None.
+    max_age : int
+        Maximum number of frames a cached feature is reused for.
+
+    Attributes
+    ----------
+    hits : int
+        Number of detections that reused a cached feature.
+    misses : int
+        Number of detections that had to be encoded. The tracker counts
+        these when it runs the encoder.
+
+    """
+
+    def __init__(self, min_iou=0.9, max_pixel_delta=None, max_age=30):
+        if min_iou is None and max_pixel_delta is None:
+            raise ValueError(
+                "At least one of min_iou and max_pixel_delta must be set")
+        self.min_iou = min_iou
+        self.max_pixel_delta = max_pixel_delta
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._frame_idx = 0
+        self._entries = {}
+        self._reused = {}
+
+    @property
+    def hit_rate(self):
+        """The fraction of needed features that have been reused."""
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def __len__(self):
+        return len(self._entries)
+
+    def step(self):
+        """Advance the cache to the next frame. Call once per frame before
+        `reuse`.
+        """
+        self._frame_idx += 1
+        self._reused = {}
+
+    def reuse(self, track_ids, detections):
+        """Fill in the cached feature of a track for the detection paired
+        with it, if the detection has no feature and its box is close to the
+        cached box.
+
+        Parameters
+        ----------
+        track_ids : List[int]
+            The track identifiers.
+        detections : List[deep_sort.detection.Detection]
+            The detections, where `detections[i]` is paired with
+            `track_ids[i]`.
+
+        Returns
+        -------
+        List[deep_sort.detection.Detection]
+            The detections that still have no feature.
+
+        """
+        pairs = []
+        for track_id, detection in zip(track_ids, detections):
+            entry = self._entries.get(track_id)
+            if detection.feature is None and entry is not None and \
+                    self._frame_idx - entry[2] <= self.max_age:
+                pairs.append((track_id, detection, entry))
+        if len(pairs) > 0:
+            candidates = np.asarray([d.tlwh for _, d, _ in pairs])
+            cached = np.asarray([entry[0] for _, _, entry in pairs])
+            reusable = np.ones(len(pairs), dtype=bool)
+            if self.min_iou is not None:
+                iou = iou_matching.paired_iou(candidates, cached)
+                reusable &= iou >= self.min_iou
+            if self.max_pixel_delta is not None:
+                delta = np.abs(np.hstack((
+                    candidates[:, :2] - cached[:, :2],
+                    candidates[:, :2] + candidates[:, 2:] -
+                    cached[:, :2] - cached[:, 2:])))
+                reusable &= delta.max(axis=1) <= self.max_pixel_delta
+            for k in np.flatnonzero(reusable):
+                track_id, detection, entry = pairs[k]
+                detection.feature = entry[1]
+                self._reused[id(detection)] = (track_id, entry)
+        return [d for d in detections if d.feature is None]
+
+    def validate(self, track_ids, detections):
+        """Drop reused features of detections that have not been associated
+        with the track the feature has been taken from.
+
+        Parameters
+        ----------
+        track_ids : List[Optional[int]]
+            The identifier of the track `detections[i]` has been associated
+            with, or None if the detection starts a new track.
+        detections : List[deep_sort.detection.Detection]
+            The detections of the current frame.
+
+        """
+        for track_id, detection in zip(track_ids, detections):
+            reused = self._reused.get(id(detection))
+            if reused is not None and reused[0] != track_id:
+                detection.feature = None
+                del self._reused[id(detection)]
+
+    def add(self, track_id, detection):
+        """Remember the feature of the detection that was associated with a
+        track in the current frame. If the feature has been reused from the
+        cache, the box and age of the originally encoded crop are kept.
+
+        Parameters
+        ----------
+        track_id : int
+            The track identifier.
+        detection : deep_sort.detection.Detection
+            The associated detection.
+
+        """
+        if detection.feature is None:
+            return
+        reused = self._reused.get(id(detection))
+        if reused is not None and reused[0] == track_id:
+            self.hits += 1
+            entry = reused[1]
+        else:
+            entry = (detection.tlwh, detection.feature, self._frame_idx)
+        self._entries[track_id] = entry
+
+    def evict(self, track_ids):
+        """Remove the entries of the given (deleted) tracks."""
+        for track_id in track_ids:
+            self._entries.pop(track_id, None)
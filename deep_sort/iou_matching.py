@@ -2,6 +2,7 @@
 from __future__ import absolute_import
 import numpy as np
 from . import linear_assignment
+from . import spatial_index
 
 
 def iou(bbox, candidates):
@@ -39,6 +40,37 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def paired_iou(bboxes, candidates):
+    """Compute intersection over union between pairs of boxes.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        An Nx4 matrix of candidate bounding boxes in the same format as
+        `bboxes`, where `candidates[i]` is paired with `bboxes[i]`.
+
+    Returns
+    -------
+    ndarray
+        Returns an array of length N where element i is the intersection over
+        union in [0, 1] between `bboxes[i]` and `candidates[i]`.
+
+    """
+    tl = np.maximum(bboxes[:, :2], candidates[:, :2])
+    br = np.minimum(bboxes[:, :2] + bboxes[:, 2:],
+                    candidates[:, :2] + candidates[:, 2:])
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh.prod(axis=1)
+    area_bboxes = bboxes[:, 2:].prod(axis=1)
+    area_candidates = candidates[:, 2:].prod(axis=1)
+    return area_intersection / (
+        area_bboxes + area_candidates - area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None,
              detection_indices=None):
     """An intersection over union distance metric.
@@ -63,19 +95,32 @@ def iou_cost(tracks, detections, track_indices=None,
         len(track_indices), len(detection_indices) where entry (i, j) is
         `1 - iou(tracks[track_indices[i]], detections[detection_indices[j]])`.
 
+    Notes
+    -----
+    The IoU is only computed for pairs of boxes that overlap, which are found
+    with `spatial_index.overlapping_pairs`. All other pairs have an IoU of 0,
+    i.e., a cost of 1.
+
     """
     if track_indices is None:
         track_indices = np.arange(len(tracks))
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros((len(track_indices), len(detection_indices)))
+
+    bboxes = np.asarray([tracks[i].to_tlwh() for i in track_indices])
+    candidates = np.asarray([detections[i].tlwh for i in detection_indices])
+    too_old = np.asarray(
+        [tracks[i].time_since_update > 1 for i in track_indices])
 
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    cost_matrix = np.ones((len(track_indices), len(detection_indices)))
+    rows, cols = spatial_index.overlapping_pairs(
+        np.hstack((bboxes[:, :2], bboxes[:, :2] + bboxes[:, 2:])),
+        np.hstack((candidates[:, :2], candidates[:, :2] + candidates[:, 2:])))
+    valid = ~too_old[rows]
+    rows, cols = rows[valid], cols[valid]
+    cost_matrix[rows, cols] = 1. - paired_iou(bboxes[rows], candidates[cols])
+    cost_matrix[too_old, :] = linear_assignment.INFTY_COST
     return cost_matrix
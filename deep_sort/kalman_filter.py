@@ -20,6 +20,35 @@ chi2inv95 = {
     9: 16.919}
 
 
+def _solve_triangular(factor, b, transpose=False):
+    """Solve `factor * x = b` for a stack of lower triangular matrices by
+    substitution, or `factor^T * x = b` if `transpose` is True.
+
+    Parameters
+    ----------
+    factor : ndarray
+        The NxDxD lower triangular matrices, e.g., Cholesky factors.
+    b : ndarray
+        The NxDxK right-hand sides.
+
+    Returns
+    -------
+    ndarray
+        The NxDxK solutions.
+
+    """
+    x = np.array(b, dtype=np.float64)
+    ndim = factor.shape[-1]
+    for i in (reversed(range(ndim)) if transpose else range(ndim)):
+        if transpose:
+            x[:, i] -= np.einsum(
+                "nj,njk->nk", factor[:, i + 1:, i], x[:, i + 1:])
+        else:
+            x[:, i] -= np.einsum("nj,njk->nk", factor[:, i, :i], x[:, :i])
+        x[:, i] /= factor[:, i, i, np.newaxis]
+    return x
+
+
 class KalmanFilter(object):
     """
     A simple Kalman filter for tracking bounding boxes in image space.
@@ -122,6 +151,40 @@ class KalmanFilter(object):
 
         return mean, covariance
 
+    def multi_predict(self, mean, covariance):
+        """Run Kalman filter prediction step for several states at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of the mean vectors of N object states
+            at the previous time step.
+        covariance : ndarray
+            The Nx8x8 dimensional array of the covariance matrices of N object
+            states at the previous time step.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 mean matrix and Nx8x8 covariance array of the
+            predicted states.
+
+        """
+        height = mean[:, 3]
+        std = np.zeros_like(mean)
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-2
+        std[:, [4, 5, 7]] = self._std_weight_velocity * height[:, np.newaxis]
+        std[:, 6] = 1e-5
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._motion_mat, covariance), self._motion_mat.T)
+        diagonal = np.arange(mean.shape[1])
+        covariance[:, diagonal, diagonal] += np.square(std)
+
+        return mean, covariance
+
     def project(self, mean, covariance):
         """Project state distribution to measurement space.
 
@@ -151,7 +214,65 @@ class KalmanFilter(object):
             self._update_mat, covariance, self._update_mat.T))
         return mean, covariance + innovation_cov
 
-    def update(self, mean, covariance, measurement):
+    def multi_project(self, mean, covariance):
+        """Project several state distributions to measurement space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices of the given state estimates.
+
+        """
+        height = mean[:, 3]
+        std = np.empty((len(mean), 4))
+        std[:, [0, 1, 3]] = self._std_weight_position * height[:, np.newaxis]
+        std[:, 2] = 1e-1
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(
+            np.matmul(self._update_mat, covariance), self._update_mat.T)
+        diagonal = np.arange(mean.shape[1])
+        covariance[:, diagonal, diagonal] += np.square(std)
+        return mean, covariance
+
+    def project_factor(self, mean, covariance):
+        """Project state distribution to measurement space and factorize the
+        projected covariance.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The state's mean vector (8 dimensional array).
+        covariance : ndarray
+            The state's covariance matrix (8x8 dimensional).
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray)
+            Returns the projected mean, the projected covariance matrix and
+            its lower triangular Cholesky factor. The result can be passed as
+            `projection` to `update` and `gating_distance`.
+
+        """
+        projected_mean, projected_cov = self.project(mean, covariance)
+        return projected_mean, projected_cov, np.linalg.cholesky(projected_cov)
+
+    def multi_project_factor(self, mean, covariance):
+        """Vectorized version of `project_factor` for Nx8 means and Nx8x8
+        covariances.
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+        return projected_mean, projected_cov, np.linalg.cholesky(projected_cov)
+
+    def update(self, mean, covariance, measurement, projection=None):
         """Run Kalman filter correction step.
 
         Parameters
@@ -164,6 +285,9 @@ class KalmanFilter(object):
             The 4 dimensional measurement vector (x, y, a, h), where (x, y)
             is the center position, a the aspect ratio, and h the height of the
             bounding box.
+        projection : Optional[(ndarray, ndarray, ndarray)]
+            The result of `project_factor` for the given state. If None, it is
+            computed here.
 
         Returns
         -------
@@ -171,12 +295,12 @@ class KalmanFilter(object):
             Returns the measurement-corrected state distribution.
 
         """
-        projected_mean, projected_cov = self.project(mean, covariance)
+        if projection is None:
+            projection = self.project_factor(mean, covariance)
+        projected_mean, projected_cov, chol_factor = projection
 
-        chol_factor, lower = scipy.linalg.cho_factor(
-            projected_cov, lower=True, check_finite=False)
         kalman_gain = scipy.linalg.cho_solve(
-            (chol_factor, lower), np.dot(covariance, self._update_mat.T).T,
+            (chol_factor, True), np.dot(covariance, self._update_mat.T).T,
             check_finite=False).T
         innovation = measurement - projected_mean
 
@@ -185,8 +309,49 @@ class KalmanFilter(object):
             kalman_gain, projected_cov, kalman_gain.T))
         return new_mean, new_covariance
 
+    def multi_update(self, mean, covariance, measurements, projection=None):
+        """Run Kalman filter correction step for several states at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of predicted state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurements : ndarray
+            The Nx4 dimensional matrix of measurement vectors (x, y, a, h),
+            where row i is associated with state i.
+        projection : Optional[(ndarray, ndarray, ndarray)]
+            The result of `multi_project_factor` for the given states. If
+            None, the states are projected here.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        if projection is None:
+            projection = self.multi_project_factor(mean, covariance)
+        projected_mean, projected_cov, chol_factor = projection
+
+        # Solve projected_cov * kalman_gain^T = (covariance * H^T)^T for all
+        # states with the Cholesky factors of the projected covariances.
+        kalman_gain = _solve_triangular(
+            chol_factor, _solve_triangular(
+                chol_factor, np.matmul(self._update_mat, covariance)),
+            transpose=True)
+        kalman_gain = kalman_gain.transpose(0, 2, 1)
+        innovation = measurements - projected_mean
+
+        new_mean = mean + np.einsum("nij,nj->ni", kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov),
+            kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
     def gating_distance(self, mean, covariance, measurements,
-                        only_position=False):
+                        only_position=False, projection=None):
         """Compute gating distance between state distribution and measurements.
 
         A suitable distance threshold can be obtained from `chi2inv95`. If
@@ -206,6 +371,9 @@ class KalmanFilter(object):
         only_position : Optional[bool]
             If True, distance computation is done with respect to the bounding
             box center position only.
+        projection : Optional[(ndarray, ndarray, ndarray)]
+            The result of `project_factor` for the given state. If None, it is
+            computed here.
 
         Returns
         -------
@@ -215,15 +383,97 @@ class KalmanFilter(object):
             `measurements[i]`.
 
         """
-        mean, covariance = self.project(mean, covariance)
+        if projection is None:
+            projection = self.project_factor(mean, covariance)
+        mean, _, cholesky_factor = projection
         if only_position:
-            mean, covariance = mean[:2], covariance[:2, :2]
+            # The leading block of a Cholesky factor is the Cholesky factor of
+            # the leading block of the covariance.
+            mean, cholesky_factor = mean[:2], cholesky_factor[:2, :2]
             measurements = measurements[:, :2]
 
-        cholesky_factor = np.linalg.cholesky(covariance)
         d = measurements - mean
         z = scipy.linalg.solve_triangular(
             cholesky_factor, d.T, lower=True, check_finite=False,
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False, projection=None):
+        """Vectorized version of `gating_distance` for N state distributions.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        projection : Optional[(ndarray, ndarray, ndarray)]
+            The result of `multi_project_factor` for the given states. If
+            None, it is computed here.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between state i and `measurements[j]`.
+
+        """
+        if projection is None:
+            projection = self.multi_project_factor(mean, covariance)
+        mean, _, cholesky_factor = projection
+        if only_position:
+            mean, cholesky_factor = mean[:, :2], cholesky_factor[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        d = measurements[np.newaxis, :, :] - mean[:, np.newaxis, :]
+        z = _solve_triangular(cholesky_factor, d.transpose(0, 2, 1))
+        return np.sum(z * z, axis=1)
+
+    def paired_gating_distance(self, mean, covariance, measurements,
+                               only_position=False, projection=None):
+        """Compute the gating distance between N state distributions and N
+        measurements, where state i is paired with `measurements[i]`.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional array of state covariance matrices.
+        measurements : ndarray
+            An Nx4 dimensional matrix of N measurements in format
+            (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        projection : Optional[(ndarray, ndarray, ndarray)]
+            The result of `multi_project_factor` for the given states. If
+            None, it is computed here.
+
+        Returns
+        -------
+        ndarray
+            Returns an array of length N, where the i-th element contains the
+            squared Mahalanobis distance between state i and
+            `measurements[i]`.
+
+        """
+        if len(measurements) == 0:
+            return np.zeros(0)
+        if projection is None:
+            projection = self.multi_project_factor(mean, covariance)
+        mean, _, cholesky_factor = projection
+        if only_position:
+            mean, cholesky_factor = mean[:, :2], cholesky_factor[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        d = measurements - mean
+        z = _solve_triangular(cholesky_factor, d[:, :, np.newaxis])
+        return np.sum(z * z, axis=(1, 2))
@@ -2,12 +2,24 @@
 from __future__ import absolute_import
 import numpy as np
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from . import kalman_filter
 
 
 INFTY_COST = 1e+5
 
 
+def _group_by_label(indices, labels):
+    """Group `indices` by `labels[indices]`. Returns a dictionary that maps
+    from label to the sorted array of indices with that label.
+    """
+    indices = indices[np.argsort(labels[indices], kind="stable")]
+    sorted_labels = labels[indices]
+    splits = np.flatnonzero(np.diff(sorted_labels)) + 1
+    return dict(zip(sorted_labels[np.r_[0, splits]], np.split(indices, splits)))
+
+
 def min_cost_matching(
         distance_metric, max_distance, tracks, detections, track_indices=None,
         detection_indices=None):
@@ -55,24 +67,54 @@ def min_cost_matching(
     cost_matrix = distance_metric(
         tracks, detections, track_indices, detection_indices)
     cost_matrix[cost_matrix > max_distance] = max_distance + 1e-5
-    indices = linear_sum_assignment(cost_matrix)
-    indices = np.asarray(indices)
-    indices = np.transpose(indices)
-    matches, unmatched_tracks, unmatched_detections = [], [], []
-    for col, detection_idx in enumerate(detection_indices):
-        if col not in indices[:, 1]:
-            unmatched_detections.append(detection_idx)
-    for row, track_idx in enumerate(track_indices):
-        if row not in indices[:, 0]:
-            unmatched_tracks.append(track_idx)
-    for row, col in indices:
-        track_idx = track_indices[row]
-        detection_idx = detection_indices[col]
-        if cost_matrix[row, col] > max_distance:
-            unmatched_tracks.append(track_idx)
-            unmatched_detections.append(detection_idx)
-        else:
-            matches.append((track_idx, detection_idx))
+
+    # Only entries below the gating threshold can become matches. These split
+    # the bipartite track/detection graph into connected components that are
+    # solved independently of each other.
+    num_rows, num_cols = cost_matrix.shape
+    feasible_rows, feasible_cols = np.nonzero(cost_matrix <= max_distance)
+    matched_rows, matched_cols = [], []
+    if len(feasible_rows) > 0:
+        graph = coo_matrix(
+            (np.ones(len(feasible_rows)),
+             (feasible_rows, num_rows + feasible_cols)),
+            shape=(num_rows + num_cols, num_rows + num_cols))
+        _, labels = connected_components(graph, directed=False)
+        component_rows = _group_by_label(
+            np.unique(feasible_rows), labels[:num_rows])
+        component_cols = _group_by_label(
+            np.unique(feasible_cols), labels[num_rows:])
+        for label, rows in component_rows.items():
+            cols = component_cols[label]
+            if len(rows) == 1 and len(cols) == 1:
+                matched_rows.append(rows)
+                matched_cols.append(cols)
+                continue
+            block_rows, block_cols = linear_sum_assignment(
+                cost_matrix[np.ix_(rows, cols)])
+            rows, cols = rows[block_rows], cols[block_cols]
+            valid = cost_matrix[rows, cols] <= max_distance
+            matched_rows.append(rows[valid])
+            matched_cols.append(cols[valid])
+
+    if len(matched_rows) > 0:
+        matched_rows = np.concatenate(matched_rows)
+        matched_cols = np.concatenate(matched_cols)
+        order = np.argsort(matched_rows)
+        matched_rows, matched_cols = matched_rows[order], matched_cols[order]
+    else:
+        matched_rows = matched_cols = np.zeros(0, dtype=np.int64)
+
+    track_indices = np.asarray(track_indices)
+    detection_indices = np.asarray(detection_indices)
+    matches = list(zip(track_indices[matched_rows].tolist(),
+                       detection_indices[matched_cols].tolist()))
+    unmatched_rows = np.ones(num_rows, dtype=bool)
+    unmatched_rows[matched_rows] = False
+    unmatched_cols = np.ones(num_cols, dtype=bool)
+    unmatched_cols[matched_cols] = False
+    unmatched_tracks = track_indices[unmatched_rows].tolist()
+    unmatched_detections = detection_indices[unmatched_cols].tolist()
     return matches, unmatched_tracks, unmatched_detections
 
 
@@ -120,16 +162,18 @@ def matching_cascade(
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
+    # Group tracks by cascade level in a single pass.
+    tracks_by_level = {}
+    for k in track_indices:
+        tracks_by_level.setdefault(tracks[k].time_since_update, []).append(k)
+
     unmatched_detections = detection_indices
     matches = []
     for level in range(cascade_depth):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
+        track_indices_l = tracks_by_level.get(1 + level, [])
         if len(track_indices_l) == 0:  # Nothing to match at this level
             continue
 
@@ -181,11 +225,14 @@ def gate_cost_matrix(
     """
     gating_dim = 2 if only_position else 4
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return cost_matrix
     measurements = np.asarray(
         [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    # Reuse the projections cached on the tracks for the current time step.
+    projections = [tracks[i].project(kf) for i in track_indices]
+    projection = tuple(np.asarray(p) for p in zip(*projections))
+    gating_distance = kf.multi_gating_distance(
+        None, None, measurements, only_position, projection=projection)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
     return cost_matrix
@@ -67,12 +67,11 @@ def _nn_euclidean_distance(x, y):
     Returns
     -------
     ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest Euclidean distance to a sample in `x`.
+        A matrix of size N, M that contains the squared Euclidean distance
+        between every sample in `x` and every query in `y`.
 
     """
-    distances = _pdist(x, y)
-    return np.maximum(0.0, distances.min(axis=0))
+    return _pdist(x, y)
 
 
 def _nn_cosine_distance(x, y):
@@ -81,19 +80,64 @@ def _nn_cosine_distance(x, y):
     Parameters
     ----------
     x : ndarray
-        A matrix of N row-vectors (sample points).
+        A matrix of N row-vectors (sample points) of unit length.
     y : ndarray
-        A matrix of M row-vectors (query points).
+        A matrix of M row-vectors (query points) of unit length.
+
+    Returns
+    -------
+    ndarray
+        A matrix of size N, M that contains the cosine distance between every
+        sample in `x` and every query in `y`.
+
+    """
+    return _cosine_distance(x, y, data_is_normalized=True)
+
+
+def _paired_nn_euclidean_distance(x, y):
+    """ Helper function for paired nearest neighbor distance (Euclidean).
+
+    Parameters
+    ----------
+    x : ndarray
+        An NxLxM array of N galleries of L samples each.
+    y : ndarray
+        An NxM matrix of N query points, where `y[i]` is paired with `x[i]`.
 
     Returns
     -------
     ndarray
-        A vector of length M that contains for each entry in `y` the
-        smallest cosine distance to a sample in `x`.
+        An NxL matrix that contains the squared Euclidean distance between
+        every sample in `x[i]` and `y[i]`.
 
     """
-    distances = _cosine_distance(x, y)
-    return distances.min(axis=0)
+    return np.square(x - y[:, np.newaxis, :]).sum(axis=2)
+
+
+def _paired_nn_cosine_distance(x, y):
+    """ Helper function for paired nearest neighbor distance (cosine).
+
+    Parameters
+    ----------
+    x : ndarray
+        An NxLxM array of N galleries of L samples each of unit length.
+    y : ndarray
+        An NxM matrix of N query points of unit length, where `y[i]` is paired
+        with `x[i]`.
+
+    Returns
+    -------
+    ndarray
+        An NxL matrix that contains the cosine distance between every sample
+        in `x[i]` and `y[i]`.
+
+    """
+    return 1. - np.einsum("nlm,nm->nl", x, y)
+
+
+# Upper bound on the number of gallery elements gathered at once by
+# `NearestNeighborDistanceMetric.paired_distance`.
+_PAIRED_CHUNK_SIZE = 1 << 22
 
 
 class NearestNeighborDistanceMetric(object):
@@ -114,9 +158,21 @@ class NearestNeighborDistanceMetric(object):
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    samples : Dict[int -> ndarray]
+        A dictionary that maps from target identities to the matrix of samples
+        that have been observed so far (one sample per row, not ordered by
+        time).
+
+    Notes
+    -----
+    Samples are stored in one preallocated float32 array of shape
+    (slots, budget, dim). Every target owns one slot that is used as a
+    ring buffer of `budget` samples, so appending and evicting a sample is
+    O(1). Slots of targets that are no longer active are recycled through a
+    free list. Without a budget, every slot owns a separate array whose
+    capacity is doubled when it runs full, so a long gallery does not grow
+    the storage of the other slots. For the cosine metric samples are
+    normalized to unit length when they are added.
 
     """
 
@@ -125,14 +181,90 @@ class NearestNeighborDistanceMetric(object):
 
         if metric == "euclidean":
             self._metric = _nn_euclidean_distance
+            self._paired_metric = _paired_nn_euclidean_distance
+            self._normalize = False
         elif metric == "cosine":
             self._metric = _nn_cosine_distance
+            self._paired_metric = _paired_nn_cosine_distance
+            self._normalize = True
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+
+        self._features = None
+        self._galleries = []
+        self._lengths = np.zeros(0, dtype=np.int64)
+        self._heads = np.zeros(0, dtype=np.int64)
+        self._slots = {}
+        self._free_slots = []
+
+    @property
+    def samples(self):
+        if self.budget is None:
+            return {target: self._galleries[slot][:self._lengths[slot]]
+                    for target, slot in self._slots.items()}
+        return {target: self._features[slot, :self._lengths[slot]]
+                for target, slot in self._slots.items()}
+
+    def _allocate_slot(self, target, dim):
+        if len(self._free_slots) == 0:
+            # Double the number of slots.
+            num_slots = len(self._lengths)
+            new_slots = max(num_slots, 8)
+            if self.budget is None:
+                self._galleries.extend([None] * new_slots)
+            else:
+                if self._features is None:
+                    self._features = np.zeros(
+                        (0, self.budget, dim), dtype=np.float32)
+                self._features = np.concatenate((
+                    self._features,
+                    np.zeros((new_slots, self.budget, dim),
+                             dtype=np.float32)))
+            self._lengths = np.r_[self._lengths, np.zeros(new_slots, np.int64)]
+            self._heads = np.r_[self._heads, np.zeros(new_slots, np.int64)]
+            self._free_slots = list(
+                range(num_slots + new_slots - 1, num_slots - 1, -1))
+        slot = self._free_slots.pop()
+        if self.budget is None:
+            self._galleries[slot] = np.zeros((16, dim), dtype=np.float32)
+        self._lengths[slot] = 0
+        self._heads[slot] = 0
+        self._slots[target] = slot
+        return slot
+
+    def _append(self, slot, feature):
+        length = self._lengths[slot]
+        if self.budget is None:
+            # Without a budget galleries are unbounded; samples are appended
+            # and the capacity of the slot is doubled when it runs full.
+            gallery = self._galleries[slot]
+            if length == len(gallery):
+                gallery = np.concatenate((gallery, np.zeros_like(gallery)))
+                self._galleries[slot] = gallery
+            gallery[length] = feature
+            self._lengths[slot] = length + 1
+            return
+        head = self._heads[slot]
+        self._features[slot, head] = feature
+        self._heads[slot] = (head + 1) % self.budget
+        self._lengths[slot] = min(length + 1, self.budget)
+
+    def _gather(self, slots, num_samples):
+        """Returns the first `num_samples` samples of the given slots as an
+        array of shape (len(slots), num_samples, dim). Galleries with fewer
+        samples are padded with zeros.
+        """
+        if self.budget is not None:
+            return self._features[slots, :num_samples]
+        dim = self._galleries[slots[0]].shape[1]
+        gallery = np.zeros((len(slots), num_samples, dim), dtype=np.float32)
+        for i, slot in enumerate(slots):
+            length = self._lengths[slot]
+            gallery[i, :length] = self._galleries[slot][:length]
+        return gallery
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -147,11 +279,21 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize and len(features) > 0:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
-            if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+            slot = self._slots.get(target)
+            if slot is None:
+                slot = self._allocate_slot(target, len(feature))
+            self._append(slot, feature)
+
+        active_targets = set(active_targets)
+        inactive_targets = [
+            k for k in self._slots if k not in active_targets]
+        for target in inactive_targets:
+            self._free_slots.append(self._slots.pop(target))
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -172,6 +314,67 @@ class NearestNeighborDistanceMetric(object):
 
         """
         cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
+        if len(targets) == 0 or len(features) == 0:
+            return cost_matrix
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
+
+        # Compute the distance between the galleries of all targets and all
+        # features in one matrix product, then take the minimum over the
+        # valid samples of each target.
+        slots = np.asarray([self._slots[target] for target in targets])
+        lengths = self._lengths[slots]
+        gallery = self._gather(slots, lengths.max())
+        num_targets, num_samples, dim = gallery.shape
+        distances = self._metric(
+            gallery.reshape(num_targets * num_samples, dim), features)
+        distances = distances.reshape(num_targets, num_samples, len(features))
+        distances[np.arange(num_samples) >= lengths[:, np.newaxis]] = np.inf
+        cost_matrix[:] = distances.min(axis=1)
         return cost_matrix
+
+    def paired_distance(self, features, targets):
+        """Compute distance between pairs of features and targets.
+
+        Unlike `distance`, which compares every feature against every target,
+        this compares `features[i]` against `targets[i]` only. Use it when
+        only a sparse set of feature/target pairs is of interest.
+
+        Parameters
+        ----------
+        features : ndarray
+            An NxM matrix of N features of dimensionality M.
+        targets : List[int]
+            A list of N targets, where `targets[i]` is paired with
+            `features[i]`.
+
+        Returns
+        -------
+        ndarray
+            Returns an array of length N, where element i contains the closest
+            distance between `targets[i]` and `features[i]`.
+
+        """
+        costs = np.zeros(len(targets))
+        if len(targets) == 0:
+            return costs
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize:
+            features = features / np.linalg.norm(
+                features, axis=1, keepdims=True)
+
+        slots = np.asarray([self._slots[target] for target in targets])
+        lengths = self._lengths[slots]
+        num_samples = lengths.max()
+        invalid = np.arange(num_samples) >= lengths[:, np.newaxis]
+        chunk_size = max(
+            1, _PAIRED_CHUNK_SIZE // (num_samples * features.shape[1]))
+        for start in range(0, len(slots), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            distances = self._paired_metric(
+                self._gather(slots[chunk], num_samples), features[chunk])
+            distances[invalid[chunk]] = np.inf
+            costs[chunk] = distances.min(axis=1)
+        return costs
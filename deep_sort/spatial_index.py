@@ -0,0 +1,92 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+
+
+def overlapping_pairs(boxes, candidates):
+    """Find all pairs of overlapping axis-aligned boxes.
+
+    The candidates are sorted by their left edge once. Every box then selects
+    the range of candidates that can overlap it along the x-axis by binary
+    search, and only the pairs within this range are tested for overlap along
+    the y-axis. The cost is O((N + M) log M) plus the number of pairs that
+    overlap along the x-axis, instead of O(N * M).
+
+    Parameters
+    ----------
+    boxes : ndarray
+        An Nx4 matrix of boxes in format `(min x, min y, max x, max y)`.
+    candidates : ndarray
+        An Mx4 matrix of candidate boxes in the same format as `boxes`.
+        Candidates may be degenerate, e.g., points with min == max.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the row indices into `boxes` and the column indices into
+        `candidates` of all pairs that overlap or touch, ordered by row.
+
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    candidates = np.asarray(candidates, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0 or len(candidates) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    order = np.argsort(candidates[:, 0], kind="stable")
+    min_x = candidates[order, 0]
+    max_width = np.max(candidates[:, 2] - candidates[:, 0])
+
+    # A candidate overlaps box i along the x-axis only if its left edge lies
+    # in [box min x - max_width, box max x].
+    start = np.searchsorted(min_x, boxes[:, 0] - max_width, side="left")
+    stop = np.searchsorted(min_x, boxes[:, 2], side="right")
+    counts = stop - start
+    rows = np.repeat(np.arange(len(boxes)), counts)
+    offsets = np.arange(len(rows)) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    cols = order[np.repeat(start, counts) + offsets]
+
+    overlap = (
+        (candidates[cols, 2] >= boxes[rows, 0]) &
+        (candidates[cols, 0] <= boxes[rows, 2]) &
+        (candidates[cols, 3] >= boxes[rows, 1]) &
+        (candidates[cols, 1] <= boxes[rows, 3]))
+    return rows[overlap], cols[overlap]
+
+
+def gating_pairs(projected_mean, projected_cov, measurements,
+                 gating_threshold):
+    """Find candidate track/measurement pairs for Mahalanobis gating.
+
+    The squared Mahalanobis distance is bounded from below by the squared
+    distance along any single axis divided by the variance along that axis.
+    A measurement can therefore only pass the gate of a track if its center
+    lies within `sqrt(gating_threshold * variance)` of the projected track
+    center along x and along y. All other pairs are infeasible.
+
+    Parameters
+    ----------
+    projected_mean : ndarray
+        The Nx4 matrix of track state means projected to measurement space.
+    projected_cov : ndarray
+        The Nx4x4 array of projected state covariance matrices.
+    measurements : ndarray
+        An Mx4 matrix of measurements in format (x, y, a, h), where (x, y) is
+        the bounding box center.
+    gating_threshold : float
+        The gating threshold on the squared Mahalanobis distance.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the row indices into the tracks and the column indices into
+        `measurements` of all candidate pairs, ordered by row.
+
+    """
+    radius = np.sqrt(gating_threshold * np.stack(
+        (projected_cov[:, 0, 0], projected_cov[:, 1, 1]), axis=1))
+    center = projected_mean[:, :2]
+    points = np.asarray(measurements)[:, :2]
+    return overlapping_pairs(
+        np.hstack((center - radius, center + radius)),
+        np.hstack((points, points)))
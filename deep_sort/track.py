@@ -40,6 +40,10 @@ class Track:
     feature : Optional[ndarray]
         Feature vector of the detection this track originates from. If not None,
         this feature is added to the `features` cache.
+    class_name : Optional[str]
+        Class name of the detection this track originates from.
+    confidence : Optional[float]
+        Detector confidence of the detection this track originates from.
 
     Attributes
     ----------
@@ -55,22 +59,32 @@ class Track:
         Total number of frames since first occurance.
     time_since_update : int
         Total number of frames since last measurement update.
+    time_since_feature : int
+        Total number of frames since a feature vector was last added to the
+        `features` cache.
     state : TrackState
         The current track state.
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    confidence : Optional[float]
+        Detector confidence of the most recently associated detection.
+    projection : Optional[(ndarray, ndarray, ndarray)]
+        Cached projection of the current state distribution to measurement
+        space, see `project`. None if it has not been computed since the last
+        change of the state distribution.
 
     """
 
     def __init__(self, mean, covariance, track_id, n_init, max_age,
-                 feature=None, class_name=None):
+                 feature=None, class_name=None, confidence=None):
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
         self.hits = 1
         self.age = 1
         self.time_since_update = 0
+        self.time_since_feature = 0
 
         self.state = TrackState.Tentative
         self.features = []
@@ -80,6 +94,8 @@ class Track:
         self._n_init = n_init
         self._max_age = max_age
         self.class_name = class_name
+        self.confidence = confidence
+        self.projection = None
 
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
@@ -113,6 +129,27 @@ class Track:
     def get_class(self):
         return self.class_name
 
+    def project(self, kf):
+        """Get the projected mean, projected covariance and its Cholesky factor
+        of the current state distribution. The result is cached until the
+        state distribution changes, so gating and the measurement update of a
+        time step share the same factorization.
+
+        Parameters
+        ----------
+        kf : kalman_filter.KalmanFilter
+            The Kalman filter.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray)
+            The result of `kf.project_factor` for the current state.
+
+        """
+        if self.projection is None:
+            self.projection = kf.project_factor(self.mean, self.covariance)
+        return self.projection
+
     def predict(self, kf):
         """Propagate the state distribution to the current time step using a
         Kalman filter prediction step.
@@ -124,8 +161,16 @@ class Track:
 
         """
         self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+        self.projection = None
+        self.increment_age()
+
+    def increment_age(self):
+        """Advance the age of this track by one time step. Called after the
+        state distribution has been propagated.
+        """
         self.age += 1
         self.time_since_update += 1
+        self.time_since_feature += 1
 
     def update(self, kf, detection):
         """Perform Kalman filter measurement update step and update the feature
@@ -140,8 +185,26 @@ class Track:
 
         """
         self.mean, self.covariance = kf.update(
-            self.mean, self.covariance, detection.to_xyah())
-        self.features.append(detection.feature)
+            self.mean, self.covariance, detection.to_xyah(),
+            self.project(kf))
+        self.mark_hit(detection)
+
+    def mark_hit(self, detection):
+        """Update the feature cache and track state after the state
+        distribution has been corrected with the associated detection.
+
+        Parameters
+        ----------
+        detection : Detection
+            The associated detection. Its feature is only added to the cache
+            if it has been computed.
+
+        """
+        self.projection = None
+        if detection.feature is not None:
+            self.features.append(detection.feature)
+            self.time_since_feature = 0
+        self.confidence = detection.confidence
 
         self.hits += 1
         self.time_since_update = 0
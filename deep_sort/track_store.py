@@ -0,0 +1,309 @@
+# vim: expandtab:ts=4:sw=4
+import numpy as np
+from .track import Track, TrackState
+
+
+class TrackStore(object):
+    """
+    Struct-of-arrays storage for the tracks of a multi-target tracker.
+
+    All track attributes are kept in parallel preallocated arrays that are
+    indexed by slot. Slots of deleted tracks are reused through a free list.
+    State machine transitions are applied to many slots at once with mask
+    operations, and `view` returns a lightweight `Track` that reads and
+    writes the arrays of a single slot for code that works on tracks one by
+    one.
+
+    Parameters
+    ----------
+    n_init : int
+        Number of consecutive detections before a track is confirmed.
+    max_age : int
+        The maximum number of consecutive misses before a track is deleted.
+    capacity : Optional[int]
+        Initial number of slots. The capacity is doubled whenever the store
+        runs full.
+
+    Attributes
+    ----------
+    track_ids : ndarray
+        The track identifier of every slot.
+    states : ndarray
+        The `TrackState` of every slot.
+    hits : ndarray
+        Total number of measurement updates of every slot.
+    ages : ndarray
+        Total number of frames since first occurance of every slot.
+    time_since_update : ndarray
+        Total number of frames since last measurement update of every slot.
+    time_since_feature : ndarray
+        Total number of frames since a feature was last added to the feature
+        cache of every slot.
+    means : ndarray
+        The Nx8 dimensional matrix of state mean vectors.
+    covariances : ndarray
+        The Nx8x8 dimensional array of state covariance matrices.
+    confidences : ndarray
+        Detector confidence of the most recently associated detection, NaN
+        if unknown.
+    alive : ndarray
+        True for slots that hold a track.
+    class_names : List[str]
+        The class name of every slot.
+    features : List[List[ndarray]]
+        The feature cache of every slot.
+
+    """
+
+    def __init__(self, n_init, max_age, capacity=64):
+        self.n_init = n_init
+        self.max_age = max_age
+
+        self.track_ids = np.zeros(capacity, dtype=np.int64)
+        self.states = np.zeros(capacity, dtype=np.int8)
+        self.hits = np.zeros(capacity, dtype=np.int64)
+        self.ages = np.zeros(capacity, dtype=np.int64)
+        self.time_since_update = np.zeros(capacity, dtype=np.int64)
+        self.time_since_feature = np.zeros(capacity, dtype=np.int64)
+        self.means = np.zeros((capacity, 8))
+        self.covariances = np.zeros((capacity, 8, 8))
+        self.confidences = np.full(capacity, np.nan)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+        # Cached projection to measurement space, see Track.project().
+        self.projected_means = np.zeros((capacity, 4))
+        self.projected_covariances = np.zeros((capacity, 4, 4))
+        self.cholesky_factors = np.zeros((capacity, 4, 4))
+        self.has_projection = np.zeros(capacity, dtype=bool)
+
+        self.class_names = [None] * capacity
+        self.features = [[] for _ in range(capacity)]
+        self._free_slots = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def _grow(self):
+        capacity = len(self.alive)
+        for name in ("track_ids", "states", "hits", "ages",
+                     "time_since_update", "time_since_feature", "means",
+                     "covariances",
+                     "confidences", "alive", "projected_means",
+                     "projected_covariances", "cholesky_factors",
+                     "has_projection"):
+            array = getattr(self, name)
+            fill = np.nan if name == "confidences" else 0
+            setattr(self, name, np.concatenate(
+                (array, np.full_like(array, fill))))
+        self.class_names += [None] * capacity
+        self.features += [[] for _ in range(capacity)]
+        self._free_slots = list(range(2 * capacity - 1, capacity - 1, -1))
+
+    def add(self, mean, covariance, track_id, feature=None, class_name=None,
+            confidence=None):
+        """Add a new tentative track.
+
+        Returns
+        -------
+        int
+            The slot of the new track.
+
+        """
+        if len(self._free_slots) == 0:
+            self._grow()
+        slot = self._free_slots.pop()
+        self.track_ids[slot] = track_id
+        self.states[slot] = TrackState.Tentative
+        self.hits[slot] = 1
+        self.ages[slot] = 1
+        self.time_since_update[slot] = 0
+        self.time_since_feature[slot] = 0
+        self.means[slot] = mean
+        self.covariances[slot] = covariance
+        self.confidences[slot] = np.nan if confidence is None else confidence
+        self.has_projection[slot] = False
+        self.alive[slot] = True
+        self.class_names[slot] = class_name
+        self.features[slot] = [] if feature is None else [feature]
+        return slot
+
+    def active_slots(self):
+        """Returns the slots of all tracks ordered by track identifier, i.e.,
+        in order of creation.
+        """
+        slots = np.flatnonzero(self.alive)
+        return slots[np.argsort(self.track_ids[slots], kind="stable")]
+
+    def view(self, slot):
+        """Returns a `Track` that reads and writes the given slot."""
+        return TrackView(self, slot)
+
+    def set_projections(self, slots, projection):
+        """Cache the result of `KalmanFilter.multi_project_factor` for the
+        given slots.
+        """
+        projected_mean, projected_cov, cholesky_factor = projection
+        self.projected_means[slots] = projected_mean
+        self.projected_covariances[slots] = projected_cov
+        self.cholesky_factors[slots] = cholesky_factor
+        self.has_projection[slots] = True
+
+    def projections(self, kf, slots):
+        """Get the cached projections of the given slots, computing missing
+        ones with `kf`.
+        """
+        missing = slots[~self.has_projection[slots]]
+        if len(missing) > 0:
+            self.set_projections(missing, kf.multi_project_factor(
+                self.means[missing], self.covariances[missing]))
+        return (self.projected_means[slots],
+                self.projected_covariances[slots],
+                self.cholesky_factors[slots])
+
+    def increment_age(self, slots):
+        """Vectorized version of `Track.increment_age`."""
+        self.ages[slots] += 1
+        self.time_since_update[slots] += 1
+        self.time_since_feature[slots] += 1
+
+    def mark_hit(self, slots, detections):
+        """Vectorized version of `Track.mark_hit`. `detections[i]` is the
+        detection associated with `slots[i]`.
+        """
+        self.has_projection[slots] = False
+        for slot, detection in zip(slots, detections):
+            if detection.feature is not None:
+                self.features[slot].append(detection.feature)
+                self.time_since_feature[slot] = 0
+        self.confidences[slots] = [d.confidence for d in detections]
+
+        self.hits[slots] += 1
+        self.time_since_update[slots] = 0
+        confirm = slots[
+            (self.states[slots] == TrackState.Tentative) &
+            (self.hits[slots] >= self.n_init)]
+        self.states[confirm] = TrackState.Confirmed
+
+    def mark_missed(self, slots):
+        """Vectorized version of `Track.mark_missed`."""
+        delete = slots[
+            (self.states[slots] == TrackState.Tentative) |
+            (self.time_since_update[slots] > self.max_age)]
+        self.states[delete] = TrackState.Deleted
+
+    def remove_deleted(self):
+        """Free the slots of all deleted tracks.
+
+        Returns
+        -------
+        ndarray
+            The identifiers of the removed tracks.
+
+        """
+        slots = np.flatnonzero(
+            self.alive & (self.states == TrackState.Deleted))
+        self.alive[slots] = False
+        for slot in slots:
+            self.features[slot] = []
+            self.class_names[slot] = None
+        self._free_slots.extend(slots[::-1].tolist())
+        return self.track_ids[slots]
+
+
+def _scalar_field(name, dtype):
+    def getter(self):
+        return dtype(getattr(self._store, name)[self.slot])
+
+    def setter(self, value):
+        getattr(self._store, name)[self.slot] = value
+    return property(getter, setter)
+
+
+def _array_field(name):
+    def getter(self):
+        return getattr(self._store, name)[self.slot]
+
+    def setter(self, value):
+        getattr(self._store, name)[self.slot] = value
+    return property(getter, setter)
+
+
+class TrackView(Track):
+    """
+    A `Track` whose attributes live in a slot of a `TrackStore`. All `Track`
+    methods work on views and write their results back to the store.
+
+    Parameters
+    ----------
+    store : TrackStore
+        The store that holds the track.
+    slot : int
+        The slot of the track in `store`.
+
+    """
+
+    def __init__(self, store, slot):
+        self._store = store
+        self.slot = slot
+
+    mean = _array_field("means")
+    covariance = _array_field("covariances")
+    track_id = _scalar_field("track_ids", int)
+    state = _scalar_field("states", int)
+    hits = _scalar_field("hits", int)
+    age = _scalar_field("ages", int)
+    time_since_update = _scalar_field("time_since_update", int)
+    time_since_feature = _scalar_field("time_since_feature", int)
+
+    @property
+    def features(self):
+        return self._store.features[self.slot]
+
+    @features.setter
+    def features(self, value):
+        self._store.features[self.slot] = value
+
+    @property
+    def class_name(self):
+        return self._store.class_names[self.slot]
+
+    @class_name.setter
+    def class_name(self, value):
+        self._store.class_names[self.slot] = value
+
+    @property
+    def confidence(self):
+        confidence = self._store.confidences[self.slot]
+        return None if np.isnan(confidence) else float(confidence)
+
+    @confidence.setter
+    def confidence(self, value):
+        self._store.confidences[self.slot] = (
+            np.nan if value is None else value)
+
+    @property
+    def projection(self):
+        store, slot = self._store, self.slot
+        if not store.has_projection[slot]:
+            return None
+        return (store.projected_means[slot],
+                store.projected_covariances[slot],
+                store.cholesky_factors[slot])
+
+    @projection.setter
+    def projection(self, value):
+        store, slot = self._store, self.slot
+        if value is None:
+            store.has_projection[slot] = False
+            return
+        (store.projected_means[slot], store.projected_covariances[slot],
+         store.cholesky_factors[slot]) = value
+        store.has_projection[slot] = True
+
+    @property
+    def _n_init(self):
+        return self._store.n_init
+
+    @property
+    def _max_age(self):
+        return self._store.max_age
@@ -4,7 +4,9 @@ import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from . import spatial_index
+from .track import TrackState
+from .track_store import TrackStore
 
 
 class Tracker:
@@ -21,6 +23,14 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    feature_interval : int
+        If features are computed on demand (see `update`), the feature of a
+        matched detection is computed at least every `feature_interval`
+        frames to refresh the appearance of its track.
+    embedding_cache : Optional[EmbeddingCache]
+        If not None and features are computed on demand, the feature of a
+        detection whose box barely moved since the last encoded crop of the
+        track it is associated with is taken from this cache instead.
 
     Attributes
     ----------
@@ -30,100 +40,237 @@ class Tracker:
         Maximum number of missed misses before a track is deleted.
     n_init : int
         Number of frames that a track remains in initialization phase.
+    feature_interval : int
+        Maximum number of frames between two feature updates of a track if
+        features are computed on demand.
+    embedding_cache : Optional[EmbeddingCache]
+        The cache of the most recently encoded feature of every track.
     kf : kalman_filter.KalmanFilter
         A Kalman filter to filter target trajectories in image space.
+    store : TrackStore
+        Struct-of-arrays storage of the active tracks.
     tracks : List[Track]
-        The list of active tracks at the current time step.
+        The list of active tracks at the current time step, as views into
+        `store` in order of creation.
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.7, max_age=60, n_init=3):
+    def __init__(self, metric, max_iou_distance=0.7, max_age=60, n_init=3,
+                 feature_interval=10, embedding_cache=None):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.feature_interval = feature_interval
+        self.embedding_cache = embedding_cache
 
         self.kf = kalman_filter.KalmanFilter()
-        self.tracks = []
+        self.store = TrackStore(n_init, max_age)
         self._next_id = 1
 
+    @property
+    def tracks(self):
+        return [self.store.view(slot) for slot in self.store.active_slots()]
+
     def predict(self):
         """Propagate track state distributions one time step forward.
 
         This function should be called once every time step, before `update`.
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        store = self.store
+        slots = np.flatnonzero(store.alive)
+        if len(slots) == 0:
+            return
+        mean, covariance = self.kf.multi_predict(
+            store.means[slots], store.covariances[slots])
+        store.means[slots], store.covariances[slots] = mean, covariance
+        # Project all tracks once per frame; gating and measurement update
+        # reuse the result.
+        store.set_projections(
+            slots, self.kf.multi_project_factor(mean, covariance))
+        store.increment_age(slots)
 
-    def update(self, detections):
+    def update(self, detections, feature_fn=None, lazy=True):
         """Perform measurement update and track management.
 
         Parameters
         ----------
         detections : List[deep_sort.detection.Detection]
             A list of detections at the current time step.
+        feature_fn : Optional[Callable[List[Detection]] -> ndarray]
+            If None, all detections must carry a feature. Otherwise, features
+            are computed on demand: detections may have no feature and
+            `feature_fn` is called to compute the NxM matrix of features of
+            N detections only where appearance is needed. These are
+            detections that pass the gate of several tracks or of a track
+            that several detections pass, detections that start a new track,
+            and matched detections of tracks whose last feature is at least
+            `feature_interval` frames old. A gated track/detection pair that
+            has no alternative is associated without appearance.
+        lazy : bool
+            Only used if `feature_fn` is not None. If False, the features of
+            all detections are computed before matching.
 
         """
+        store = self.store
+        slots = store.active_slots()
+        tracks = [store.view(slot) for slot in slots]
+
+        if feature_fn is not None and self.embedding_cache is not None:
+            self.embedding_cache.step()
+
         # Run matching cascade.
         matches, unmatched_tracks, unmatched_detections = \
-            self._match(detections)
+            self._match(tracks, detections, feature_fn, lazy)
+
+        if feature_fn is not None:
+            # New tracks need an initial feature, old features are refreshed.
+            refresh = [
+                (i, j) for i, j in matches if not lazy or
+                store.time_since_feature[slots[i]] >= self.feature_interval]
+            if self.embedding_cache is not None:
+                # Features reused before matching are only kept if the
+                # detection has been associated with the same track.
+                self.embedding_cache.validate(
+                    [store.track_ids[slots[i]] for i, _ in matches] +
+                    [None] * len(unmatched_detections),
+                    [detections[j] for _, j in matches] +
+                    [detections[j] for j in unmatched_detections])
+                self.embedding_cache.reuse(
+                    [store.track_ids[slots[i]] for i, _ in refresh],
+                    [detections[j] for _, j in refresh])
+            self._compute_features(feature_fn, [
+                detections[j] for _, j in refresh
+            ] + [detections[j] for j in unmatched_detections])
 
         # Update track set.
-        for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(
-                self.kf, detections[detection_idx])
-        for track_idx in unmatched_tracks:
-            self.tracks[track_idx].mark_missed()
+        if len(matches) > 0:
+            matched_slots = slots[[i for i, _ in matches]]
+            matched_detections = [detections[j] for _, j in matches]
+            mean, covariance = self.kf.multi_update(
+                store.means[matched_slots], store.covariances[matched_slots],
+                np.asarray([d.to_xyah() for d in matched_detections]),
+                store.projections(self.kf, matched_slots))
+            store.means[matched_slots] = mean
+            store.covariances[matched_slots] = covariance
+            store.mark_hit(matched_slots, matched_detections)
+            if self.embedding_cache is not None:
+                for slot, detection in zip(matched_slots, matched_detections):
+                    self.embedding_cache.add(store.track_ids[slot], detection)
+        store.mark_missed(slots[np.asarray(unmatched_tracks, dtype=np.int64)])
         for detection_idx in unmatched_detections:
             self._initiate_track(detections[detection_idx])
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+        deleted_ids = store.remove_deleted()
+        if self.embedding_cache is not None:
+            self.embedding_cache.evict(deleted_ids)
 
         # Update distance metric.
-        active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
+        slots = store.active_slots()
+        confirmed_slots = slots[store.states[slots] == TrackState.Confirmed]
+        active_targets = store.track_ids[confirmed_slots].tolist()
         features, targets = [], []
-        for track in self.tracks:
-            if not track.is_confirmed():
-                continue
-            features += track.features
-            targets += [track.track_id for _ in track.features]
-            track.features = []
+        for slot in confirmed_slots:
+            track_features = store.features[slot]
+            features += track_features
+            targets += [store.track_ids[slot]] * len(track_features)
+            store.features[slot] = []
         self.metric.partial_fit(
             np.asarray(features), np.asarray(targets), active_targets)
 
-    def _match(self, detections):
-
-        def gated_metric(tracks, dets, track_indices, detection_indices):
-            features = np.array([dets[i].feature for i in detection_indices])
-            targets = np.array([tracks[i].track_id for i in track_indices])
-            cost_matrix = self.metric.distance(features, targets)
-            cost_matrix = linear_assignment.gate_cost_matrix(
-                self.kf, cost_matrix, tracks, dets, track_indices,
-                detection_indices)
+    def _gate(self, tracks, detections, track_indices):
+        """Returns the pairs of rows into `track_indices` and detection
+        indices that pass the Kalman filter gate.
+        """
+        if len(track_indices) == 0 or len(detections) == 0:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        measurements = np.asarray([d.to_xyah() for d in detections])
+        slots = np.asarray([tracks[i].slot for i in track_indices])
+        projected_mean, projected_cov, cholesky_factor = \
+            self.store.projections(self.kf, slots)
 
-            return cost_matrix
+        # Only detections close to the predicted position of a track can pass
+        # its gate. The gating distance is computed for these candidate pairs
+        # only, all other pairs are infeasible.
+        gating_threshold = kalman_filter.chi2inv95[4]
+        rows, cols = spatial_index.gating_pairs(
+            projected_mean, projected_cov, measurements, gating_threshold)
+        gating_distance = self.kf.paired_gating_distance(
+            None, None, measurements[cols], projection=(
+                projected_mean[rows], projected_cov[rows],
+                cholesky_factor[rows]))
+        feasible = gating_distance <= gating_threshold
+        return rows[feasible], cols[feasible]
 
+    def _match(self, tracks, detections, feature_fn=None, lazy=True):
         # Split track set into confirmed and unconfirmed tracks.
-        confirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if t.is_confirmed()]
-        unconfirmed_tracks = [
-            i for i, t in enumerate(self.tracks) if not t.is_confirmed()]
+        states = self.store.states[[t.slot for t in tracks]]
+        confirmed_tracks = np.flatnonzero(
+            states == TrackState.Confirmed).tolist()
+        unconfirmed_tracks = np.flatnonzero(
+            states != TrackState.Confirmed).tolist()
+
+        rows, cols = self._gate(tracks, detections, confirmed_tracks)
+        if feature_fn is not None:
+            rows_count = np.bincount(rows, minlength=len(confirmed_tracks))
+            cols_count = np.bincount(cols, minlength=len(detections))
+            ambiguous = (rows_count[rows] > 1) | (cols_count[cols] > 1)
+            if lazy:
+                # Appearance is only needed to choose between several gated
+                # candidates.
+                self._compute_features(feature_fn, [
+                    detections[j] for j in np.unique(cols[ambiguous])])
+            else:
+                if self.embedding_cache is not None:
+                    # A detection that passes the gate of a single track,
+                    # which no other detection passes, may take the cached
+                    # feature of this track. `update` drops the feature if
+                    # the detection is associated otherwise.
+                    unique = np.flatnonzero(~ambiguous)
+                    self.embedding_cache.reuse(
+                        [tracks[confirmed_tracks[rows[k]]].track_id
+                         for k in unique],
+                        [detections[cols[k]] for k in unique])
+                self._compute_features(feature_fn, detections)
+
+        # Compute the gated appearance cost between all confirmed tracks and
+        # all detections once. Every level of the matching cascade slices its
+        # rows and remaining columns from this matrix. Pairs without a
+        # detection feature have no alternative and cost nothing.
+        cost_matrix = np.full(
+            (len(confirmed_tracks), len(detections)),
+            linear_assignment.INFTY_COST)
+        cost_matrix[rows, cols] = 0.
+        has_feature = np.asarray(
+            [detections[j].feature is not None for j in cols], dtype=bool)
+        rows, cols = rows[has_feature], cols[has_feature]
+        if len(rows) > 0:
+            slots = np.asarray([tracks[k].slot for k in confirmed_tracks])
+            cost_matrix[rows, cols] = self.metric.paired_distance(
+                np.asarray([detections[j].feature for j in cols]),
+                self.store.track_ids[slots[rows]])
+        cost_rows = {k: row for row, k in enumerate(confirmed_tracks)}
+
+        def cascade_metric(tracks, dets, track_indices, detection_indices):
+            rows = [cost_rows[k] for k in track_indices]
+            return cost_matrix[np.ix_(rows, detection_indices)]
 
         # Associate confirmed tracks using appearance features.
         matches_a, unmatched_tracks_a, unmatched_detections = \
             linear_assignment.matching_cascade(
-                gated_metric, self.metric.matching_threshold, self.max_age,
-                self.tracks, detections, confirmed_tracks)
+                cascade_metric, self.metric.matching_threshold, self.max_age,
+                tracks, detections, confirmed_tracks)
 
         # Associate remaining tracks together with unconfirmed tracks using IOU.
         iou_track_candidates = unconfirmed_tracks + [
             k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update == 1]
+            tracks[k].time_since_update == 1]
         unmatched_tracks_a = [
             k for k in unmatched_tracks_a if
-            self.tracks[k].time_since_update != 1]
+            tracks[k].time_since_update != 1]
         matches_b, unmatched_tracks_b, unmatched_detections = \
             linear_assignment.min_cost_matching(
-                iou_matching.iou_cost, self.max_iou_distance, self.tracks,
+                iou_matching.iou_cost, self.max_iou_distance, tracks,
                 detections, iou_track_candidates, unmatched_detections)
 
         matches = matches_a + matches_b
@@ -133,7 +280,20 @@ class Tracker:
     def _initiate_track(self, detection):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         class_name = detection.get_class()
-        self.tracks.append(Track(
-            mean, covariance, self._next_id, self.n_init, self.max_age,
-            detection.feature, class_name))
+        self.store.add(
+            mean, covariance, self._next_id, detection.feature, class_name,
+            detection.confidence)
+        if self.embedding_cache is not None:
+            self.embedding_cache.add(self._next_id, detection)
         self._next_id += 1
+
+    def _compute_features(self, feature_fn, detections):
+        """Compute the missing features of `detections` with `feature_fn`."""
+        detections = [d for d in detections if d.feature is None]
+        if len(detections) == 0:
+            return
+        if self.embedding_cache is not None:
+            self.embedding_cache.misses += len(detections)
+        features = feature_fn(detections)
+        for detection, feature in zip(detections, features):
+            detection.feature = np.asarray(feature, dtype=np.float32)
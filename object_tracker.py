@@ -1,240 +1,794 @@
-import os
-# comment out below line to enable tensorflow logging outputs
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import time
-import tensorflow as tf
-physical_devices = tf.config.experimental.list_physical_devices('GPU')
-if len(physical_devices) > 0:
-    tf.config.experimental.set_memory_growth(physical_devices[0], True)
-from absl import app, flags, logging
-from absl.flags import FLAGS
-import core.utils as utils
-from core.yolov4 import filter_boxes
-from tensorflow.python.saved_model import tag_constants
-from core.config import cfg
-from PIL import Image
-import cv2
-import numpy as np
-import matplotlib.pyplot as plt
-from tensorflow.compat.v1 import ConfigProto
-from tensorflow.compat.v1 import InteractiveSession
-# deep sort imports
-from deep_sort import preprocessing, nn_matching
-from deep_sort.detection import Detection
-from deep_sort.tracker import Tracker
-from tools import generate_detections as gdet
-flags.DEFINE_string('framework', 'tf', '(tf, tflite, trt')
-flags.DEFINE_string('weights', './checkpoints/yolov4-416',
-                    'path to weights file')
-flags.DEFINE_integer('size', 416, 'resize images to')
-flags.DEFINE_boolean('tiny', False, 'yolo or yolo-tiny')
-flags.DEFINE_string('model', 'yolov4', 'yolov3 or yolov4')
-flags.DEFINE_string('video', './data/video/test.mp4', 'path to input video or set to 0 for webcam')
-flags.DEFINE_string('output', None, 'path to output video')
-flags.DEFINE_string('output_format', 'XVID', 'codec used in VideoWriter when saving video to file')
-flags.DEFINE_float('iou', 0.45, 'iou threshold')
-flags.DEFINE_float('score', 0.50, 'score threshold')
-flags.DEFINE_boolean('dont_show', False, 'dont show video output')
-flags.DEFINE_boolean('info', False, 'show detailed info of tracked objects')
-flags.DEFINE_boolean('count', False, 'count objects being tracked on screen')
-
-def main(_argv):
-    # Definition of the parameters
-    max_cosine_distance = 0.4
-    nn_budget = None
-    nms_max_overlap = 1.0
-    
-    # initialize deep sort
-    model_filename = 'model_data/mars-small128.pb'
-    encoder = gdet.create_box_encoder(model_filename, batch_size=1)
-    # calculate cosine distance metric
-    metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
-    # initialize tracker
-    tracker = Tracker(metric)
-
-    # load configuration for object detector
-    config = ConfigProto()
-    config.gpu_options.allow_growth = True
-    session = InteractiveSession(config=config)
-    STRIDES, ANCHORS, NUM_CLASS, XYSCALE = utils.load_config(FLAGS)
-    input_size = FLAGS.size
-    video_path = FLAGS.video
-
-    # load tflite model if flag is set
-    if FLAGS.framework == 'tflite':
-        interpreter = tf.lite.Interpreter(model_path=FLAGS.weights)
-        interpreter.allocate_tensors()
-        input_details = interpreter.get_input_details()
-        output_details = interpreter.get_output_details()
-        print(input_details)
-        print(output_details)
-    # otherwise load standard tensorflow saved model
-    else:
-        saved_model_loaded = tf.saved_model.load(FLAGS.weights, tags=[tag_constants.SERVING])
-        infer = saved_model_loaded.signatures['serving_default']
-
-    # begin video capture
-    try:
-        vid = cv2.VideoCapture(int(video_path))
-    except:
-        vid = cv2.VideoCapture(video_path)
-
-    out = None
-
-    # get video ready to save locally if flag is set
-    if FLAGS.output:
-        # by default VideoCapture returns float instead of int
-        width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = int(vid.get(cv2.CAP_PROP_FPS))
-        codec = cv2.VideoWriter_fourcc(*FLAGS.output_format)
-        out = cv2.VideoWriter(FLAGS.output, codec, fps, (width, height))
-
-    frame_num = 0
-    # while video is running
-    while True:
-        return_value, frame = vid.read()
-        if return_value:
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            image = Image.fromarray(frame)
-        else:
-            print('Video has ended or failed, try a different video format!')
-            break
-        frame_num +=1
-        print('Frame #: ', frame_num)
-        frame_size = frame.shape[:2]
-        image_data = cv2.resize(frame, (input_size, input_size))
-        image_data = image_data / 255.
-        image_data = image_data[np.newaxis, ...].astype(np.float32)
-        start_time = time.time()
-
-        # run detections on tflite if flag is set
-        if FLAGS.framework == 'tflite':
-            interpreter.set_tensor(input_details[0]['index'], image_data)
-            interpreter.invoke()
-            pred = [interpreter.get_tensor(output_details[i]['index']) for i in range(len(output_details))]
-            # run detections using yolov3 if flag is set
-            if FLAGS.model == 'yolov3' and FLAGS.tiny == True:
-                boxes, pred_conf = filter_boxes(pred[1], pred[0], score_threshold=0.25,
-                                                input_shape=tf.constant([input_size, input_size]))
-            else:
-                boxes, pred_conf = filter_boxes(pred[0], pred[1], score_threshold=0.25,
-                                                input_shape=tf.constant([input_size, input_size]))
-        else:
-            batch_data = tf.constant(image_data)
-            pred_bbox = infer(batch_data)
-            for key, value in pred_bbox.items():
-                boxes = value[:, :, 0:4]
-                pred_conf = value[:, :, 4:]
-
-        boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
-            boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
-            scores=tf.reshape(
-                pred_conf, (tf.shape(pred_conf)[0], -1, tf.shape(pred_conf)[-1])),
-            max_output_size_per_class=50,
-            max_total_size=50,
-            iou_threshold=FLAGS.iou,
-            score_threshold=FLAGS.score
-        )
-
-        # convert data to numpy arrays and slice out unused elements
-        num_objects = valid_detections.numpy()[0]
-        bboxes = boxes.numpy()[0]
-        bboxes = bboxes[0:int(num_objects)]
-        scores = scores.numpy()[0]
-        scores = scores[0:int(num_objects)]
-        classes = classes.numpy()[0]
-        classes = classes[0:int(num_objects)]
-
-        # format bounding boxes from normalized ymin, xmin, ymax, xmax ---> xmin, ymin, width, height
-        original_h, original_w, _ = frame.shape
-        bboxes = utils.format_boxes(bboxes, original_h, original_w)
-
-        # store all predictions in one parameter for simplicity when calling functions
-        pred_bbox = [bboxes, scores, classes, num_objects]
-
-        # read in all class names from config
-        class_names = utils.read_class_names(cfg.YOLO.CLASSES)
-
-        # by default allow all classes in .names file
-        #allowed_classes = list(class_names.values())
-        
-        # custom allowed classes (uncomment line below to customize tracker for only people)
-        allowed_classes = ['person']
-
-        # loop through objects and use class index to get class name, allow only classes in allowed_classes list
-        names = []
-        deleted_indx = []
-        for i in range(num_objects):
-            class_indx = int(classes[i])
-            class_name = class_names[class_indx]
-            if class_name not in allowed_classes:
-                deleted_indx.append(i)
-            else:
-                names.append(class_name)
-        names = np.array(names)
-        count = len(names)
-        if FLAGS.count:
-            cv2.putText(frame, "Objects being tracked: {}".format(count), (5, 35), cv2.FONT_HERSHEY_COMPLEX_SMALL, 2, (0, 255, 0), 2)
-            print("Objects being tracked: {}".format(count))
-        # delete detections that are not in allowed_classes
-        bboxes = np.delete(bboxes, deleted_indx, axis=0)
-        scores = np.delete(scores, deleted_indx, axis=0)
-
-        # encode yolo detections and feed to tracker
-        features = encoder(frame, bboxes)
-        detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in zip(bboxes, scores, names, features)]
-
-        #initialize color map
-        cmap = plt.get_cmap('tab20b')
-        colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
-
-        # run non-maxima supression
-        boxs = np.array([d.tlwh for d in detections])
-        scores = np.array([d.confidence for d in detections])
-        classes = np.array([d.class_name for d in detections])
-        indices = preprocessing.non_max_suppression(boxs, classes, nms_max_overlap, scores)
-        detections = [detections[i] for i in indices]       
-
-        # Call the tracker
-        tracker.predict()
-        tracker.update(detections)
-
-        # update tracks
-        for track in tracker.tracks:
-            if not track.is_confirmed() or track.time_since_update > 1:
-                continue 
-            bbox = track.to_tlbr()
-            class_name = track.get_class()
-            
-        # draw bbox on screen
-            color = colors[int(track.track_id) % len(colors)]
-            color = [i * 255 for i in color]
-            cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
-            cv2.rectangle(frame, (int(bbox[0]), int(bbox[1]-30)), (int(bbox[0])+(len(class_name)+len(str(track.track_id)))*17, int(bbox[1])), color, -1)
-            cv2.putText(frame, class_name + "-" + str(track.track_id),(int(bbox[0]), int(bbox[1]-10)),0, 0.75, (255,255,255),2)
-
-        # if enable info flag then print details about each track
-            if FLAGS.info:
-                print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(str(track.track_id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
-
-        # calculate frames per second of running detections
-        fps = 1.0 / (time.time() - start_time)
-        print("FPS: %.2f" % fps)
-        result = np.asarray(frame)
-        result = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        
-        if not FLAGS.dont_show:
-            cv2.imshow("Output Video", result)
-        
-        # if output flag is set, save video file
-        if FLAGS.output:
-            out.write(result)
-        if cv2.waitKey(1) & 0xFF == ord('q'): break
-    cv2.destroyAllWindows()
-
-if __name__ == '__main__':
-    try:
-        app.run(main)
-    except SystemExit:
-        pass
+import os
+# comment out below line to enable tensorflow logging outputs
+os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+import time
+import queue
+import threading
+from concurrent.futures import Future
+import tensorflow as tf
+physical_devices = tf.config.experimental.list_physical_devices('GPU')
+if len(physical_devices) > 0:
+    tf.config.experimental.set_memory_growth(physical_devices[0], True)
+from absl import app, flags, logging
+from absl.flags import FLAGS
+import core.utils as utils
+from core.yolov4 import filter_boxes, filter_boxes_top_k
+from tensorflow.python.saved_model import tag_constants
+from core.config import cfg
+import cv2
+import numpy as np
+import matplotlib.pyplot as plt
+from tensorflow.compat.v1 import ConfigProto
+from tensorflow.compat.v1 import InteractiveSession
+# deep sort imports
+from deep_sort import preprocessing, nn_matching
+from deep_sort.detection import Detection
+from deep_sort.tracker import Tracker
+from deep_sort.embedding_cache import EmbeddingCache
+from tools import generate_detections as gdet
+from tools.track_writer import TrackWriter, TRACK_FORMATS
+from tools.encoder_service import EncoderService
+from tools.detection_cache import DetectionRecorder, open_cache
+flags.DEFINE_string('framework', 'tf', '(tf, tflite, trt')
+flags.DEFINE_string('weights', './checkpoints/yolov4-416',
+                    'path to weights file')
+flags.DEFINE_integer('size', 416, 'resize images to')
+flags.DEFINE_boolean('tiny', False, 'yolo or yolo-tiny')
+flags.DEFINE_string('model', 'yolov4', 'yolov3 or yolov4')
+flags.DEFINE_list('model_classes', None, 'class names of a model exported with --classes but without --nms, in export order')
+flags.DEFINE_string('video', './data/video/test.mp4', 'path to input video or set to 0 for webcam')
+flags.DEFINE_list('videos', None, 'comma separated list of input videos that are tracked together, sharing one batched detector pass per frame')
+flags.DEFINE_string('output', None, 'path to output video')
+flags.DEFINE_string('output_format', 'XVID', 'codec used in VideoWriter when saving video to file')
+flags.DEFINE_float('iou', 0.45, 'iou threshold')
+flags.DEFINE_float('score', 0.50, 'score threshold')
+flags.DEFINE_integer('top_k', 0, 'keep a fixed number of candidates per image of a tflite model before non-maxima suppression; disabled if 0')
+flags.DEFINE_boolean('dont_show', False, 'dont show video output')
+flags.DEFINE_boolean('info', False, 'show detailed info of tracked objects')
+flags.DEFINE_boolean('count', False, 'count objects being tracked on screen')
+flags.DEFINE_boolean('pipeline', False, 'run decode, detection, encoding, tracking and rendering in parallel stages')
+flags.DEFINE_integer('queue_size', 8, 'maximum number of frames buffered between pipeline stages')
+flags.DEFINE_boolean('headless', False, 'skip all drawing and console output, only write track records')
+flags.DEFINE_string('tracks_output', None, 'path to file that per-frame track records are written to')
+flags.DEFINE_enum('tracks_format', 'jsonl', TRACK_FORMATS, 'format of the track records file')
+flags.DEFINE_boolean('lazy_reid', False, 'only compute appearance features of detections the tracker cannot associate by motion alone')
+flags.DEFINE_integer('feature_interval', 10, 'in lazy re-id mode, refresh the appearance of a matched track at least every this many frames')
+flags.DEFINE_boolean('embedding_cache', False, 'reuse the last appearance feature of a track while its box barely moves')
+flags.DEFINE_float('reuse_iou', 0.9, 'minimum IoU between a detection and the last encoded box of a track to reuse its feature, 0 to disable')
+flags.DEFINE_float('reuse_pixels', None, 'maximum pixel change of any box coordinate to reuse a cached feature, not checked if unset')
+flags.DEFINE_integer('reuse_max_age', 30, 'maximum number of frames a cached feature is reused for')
+flags.DEFINE_boolean('encoder_service', False, 'batch the appearance encoder requests of all sources of --videos in a shared service')
+flags.DEFINE_integer('encoder_max_batch', 64, 'maximum number of crops per batch of the encoder service')
+flags.DEFINE_float('encoder_max_wait', 5., 'maximum time in milliseconds a request waits for the encoder service to fill a batch')
+flags.DEFINE_boolean('cv2_crop', False, 'crop appearance patches on the host with OpenCV like the original encoder instead of on the encoder graph')
+flags.DEFINE_string('detection_cache', None, 'directory that detections are cached in, keyed by video and detector settings; cached detections are tracked without running the detector')
+
+# custom allowed classes (uncomment line below to customize tracker for only people)
+ALLOWED_CLASSES = ['person']
+
+
+def create_detector(input_size):
+    """Load the object detector selected by the command line flags.
+
+    Returns a function that takes a batch of preprocessed images, runs a
+    single forward pass over the whole batch and returns the prediction of
+    every image: a (boxes, pred_conf) pair of all candidates, or, for models
+    exported with non-maxima suppression, the final (boxes, scores, classes,
+    valid_detections).
+    """
+    # load tflite model if flag is set
+    if FLAGS.framework == 'tflite':
+        interpreter = tf.lite.Interpreter(model_path=FLAGS.weights)
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()
+        output_details = interpreter.get_output_details()
+        logging.debug('TFLite input details: %s', input_details)
+        logging.debug('TFLite output details: %s', output_details)
+
+        def detect(image_data):
+            # resize the input tensor whenever the number of streams changes
+            if tuple(input_details[0]['shape']) != image_data.shape:
+                interpreter.resize_tensor_input(input_details[0]['index'], image_data.shape)
+                interpreter.allocate_tensors()
+                input_details[0]['shape'] = np.array(image_data.shape)
+            interpreter.set_tensor(input_details[0]['index'], image_data)
+            interpreter.invoke()
+            pred = [interpreter.get_tensor(output_details[i]['index']) for i in range(len(output_details))]
+            # run detections using yolov3 if flag is set
+            if FLAGS.model == 'yolov3' and FLAGS.tiny == True:
+                pred = [pred[1], pred[0]]
+            if FLAGS.top_k > 0:
+                # one batch-safe pass keeps the top candidates of all images
+                boxes, pred_conf, valid_counts = filter_boxes_top_k(
+                    pred[0], pred[1], score_threshold=0.25,
+                    input_shape=tf.constant([input_size, input_size]), top_k=FLAGS.top_k)
+                counts = valid_counts.numpy()
+                return [(boxes[i:i+1, :counts[i]], pred_conf[i:i+1, :counts[i]]) for i in range(len(image_data))]
+            return [filter_boxes(pred[0][i:i+1], pred[1][i:i+1], score_threshold=0.25,
+                                 input_shape=tf.constant([input_size, input_size]))
+                    for i in range(len(image_data))]
+    # otherwise load standard tensorflow saved model
+    else:
+        saved_model_loaded = tf.saved_model.load(FLAGS.weights, tags=[tag_constants.SERVING])
+        infer = saved_model_loaded.signatures['serving_default']
+
+        def detect(image_data):
+            batch_data = tf.constant(image_data)
+            pred_bbox = infer(batch_data)
+            # models exported with --nms return the final detections
+            if 'valid_detections' in pred_bbox:
+                outputs = [pred_bbox[key] for key in ('boxes', 'scores', 'classes', 'valid_detections')]
+                return [tuple(output[i:i+1] for output in outputs) for i in range(len(image_data))]
+            # models exported with --top_k return padded candidates
+            if 'valid_counts' in pred_bbox:
+                boxes, pred_conf = pred_bbox['boxes'], pred_bbox['pred_conf']
+                counts = pred_bbox['valid_counts'].numpy()
+                return [(boxes[i:i+1, :counts[i]], pred_conf[i:i+1, :counts[i]]) for i in range(len(image_data))]
+            for key, value in pred_bbox.items():
+                boxes = value[:, :, 0:4]
+                pred_conf = value[:, :, 4:]
+            return [(boxes[i:i+1], pred_conf[i:i+1]) for i in range(len(image_data))]
+
+    return detect
+
+
+def preprocess(frame, input_size):
+    image_data = cv2.resize(frame, (input_size, input_size))
+    image_data = image_data / 255.
+    return image_data[np.newaxis, ...].astype(np.float32)
+
+
+def postprocess(pred, frame, class_names, allowed_classes):
+    """Run non-maxima suppression on the raw detector output of a single
+    frame and keep only detections of the allowed classes. Predictions of a
+    model that has been exported with non-maxima suppression are only
+    filtered.
+
+    Returns the bounding boxes in format (xmin, ymin, width, height), their
+    scores and their class names.
+    """
+    if len(pred) == 4:
+        boxes, scores, classes, valid_detections = pred
+    else:
+        boxes, pred_conf = pred
+        boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
+            boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
+            scores=tf.reshape(
+                pred_conf, (tf.shape(pred_conf)[0], -1, tf.shape(pred_conf)[-1])),
+            max_output_size_per_class=50,
+            max_total_size=50,
+            iou_threshold=FLAGS.iou,
+            score_threshold=FLAGS.score
+        )
+
+    # convert data to numpy arrays and slice out unused elements
+    num_objects = valid_detections.numpy()[0]
+    bboxes = boxes.numpy()[0]
+    bboxes = bboxes[0:int(num_objects)]
+    scores = scores.numpy()[0]
+    scores = scores[0:int(num_objects)]
+    classes = classes.numpy()[0]
+    classes = classes[0:int(num_objects)]
+
+    # format bounding boxes from normalized ymin, xmin, ymax, xmax ---> xmin, ymin, width, height
+    original_h, original_w, _ = frame.shape
+    bboxes = utils.format_boxes(bboxes, original_h, original_w)
+
+    # loop through objects and use class index to get class name, allow only classes in allowed_classes list
+    names = []
+    deleted_indx = []
+    for i in range(num_objects):
+        class_indx = int(classes[i])
+        class_name = class_names[class_indx]
+        if class_name not in allowed_classes:
+            deleted_indx.append(i)
+        else:
+            names.append(class_name)
+    names = np.array(names)
+
+    # delete detections that are not in allowed_classes
+    bboxes = np.delete(bboxes, deleted_indx, axis=0)
+    scores = np.delete(scores, deleted_indx, axis=0)
+    return bboxes, scores, names
+
+
+def features_on_demand():
+    return FLAGS.lazy_reid or FLAGS.embedding_cache
+
+
+def encode(encoder, frame, bboxes):
+    # the tracker requests features on demand in lazy re-id mode and when
+    # features may be taken from the embedding cache
+    if features_on_demand():
+        return [None] * len(bboxes)
+    return encoder(frame, bboxes)
+
+
+def submit_encode(encoder, frame, bboxes):
+    """Like `encode`, but returns a future of the features if the encoder is
+    an `EncoderService`, so the crops of several frames can share a batch.
+    """
+    if features_on_demand() or not isinstance(encoder, EncoderService):
+        return encode(encoder, frame, bboxes)
+    return encoder.submit(frame, bboxes)
+
+
+def create_feature_fn(encoder, frame):
+    """Returns the function that the tracker calls to compute the features
+    of detections in `frame` on demand, or None if all detections are encoded
+    up front.
+    """
+    if not features_on_demand():
+        return None
+    return lambda detections: encoder(frame, np.array([d.tlwh for d in detections]))
+
+
+def create_detections(bboxes, scores, names, features, nms_max_overlap):
+    detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in zip(bboxes, scores, names, features)]
+
+    # run non-maxima supression
+    boxs = np.array([d.tlwh for d in detections])
+    scores = np.array([d.confidence for d in detections])
+    classes = np.array([d.class_name for d in detections])
+    indices = preprocessing.non_max_suppression(boxs, classes, nms_max_overlap, scores)
+    return [detections[i] for i in indices]
+
+
+def detector_settings(allowed_classes, nms_max_overlap):
+    """Returns the settings that the detections of a video depend on, used
+    to key the detection cache.
+    """
+    return {'framework': FLAGS.framework, 'weights': os.path.abspath(FLAGS.weights),
+            'weights_mtime': os.path.getmtime(FLAGS.weights), 'size': FLAGS.size,
+            'tiny': FLAGS.tiny, 'model': FLAGS.model, 'iou': FLAGS.iou, 'score': FLAGS.score,
+            'classes': list(allowed_classes), 'nms_max_overlap': nms_max_overlap,
+            'top_k': FLAGS.top_k, 'model_classes': FLAGS.model_classes,
+            # cached features depend on how patches are cropped
+            'cv2_crop': FLAGS.cv2_crop}
+
+
+def record_detections(recorder, frame_num, detections, class_ids):
+    recorder.add(frame_num, [d.tlwh for d in detections], [d.confidence for d in detections],
+                 [class_ids[d.class_name] for d in detections],
+                 [d.feature for d in detections] if recorder.with_features else None)
+
+
+def confirmed_tracks(tracker):
+    """Returns (track_id, class_name, tlbr) of every track that has been
+    confirmed and updated in the current frame.
+    """
+    results = []
+    for track in tracker.tracks:
+        if not track.is_confirmed() or track.time_since_update > 1:
+            continue
+        results.append((track.track_id, track.get_class(), track.to_tlbr()))
+    return results
+
+
+def draw_tracks(frame, tracks, colors, count):
+    if FLAGS.count:
+        cv2.putText(frame, "Objects being tracked: {}".format(count), (5, 35), cv2.FONT_HERSHEY_COMPLEX_SMALL, 2, (0, 255, 0), 2)
+        print("Objects being tracked: {}".format(count))
+
+    for track_id, class_name, bbox in tracks:
+        # draw bbox on screen
+        color = colors[int(track_id) % len(colors)]
+        color = [i * 255 for i in color]
+        cv2.rectangle(frame, (int(bbox[0]), int(bbox[1])), (int(bbox[2]), int(bbox[3])), color, 2)
+        cv2.rectangle(frame, (int(bbox[0]), int(bbox[1]-30)), (int(bbox[0])+(len(class_name)+len(str(track_id)))*17, int(bbox[1])), color, -1)
+        cv2.putText(frame, class_name + "-" + str(track_id),(int(bbox[0]), int(bbox[1]-10)),0, 0.75, (255,255,255),2)
+
+        # if enable info flag then print details about each track
+        if FLAGS.info:
+            print("Tracker ID: {}, Class: {},  BBox Coords (xmin, ymin, xmax, ymax): {}".format(str(track_id), class_name, (int(bbox[0]), int(bbox[1]), int(bbox[2]), int(bbox[3]))))
+
+    return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+
+
+def show_and_write(result, out):
+    """Display and save a rendered frame. Returns False if the user asked
+    to quit.
+    """
+    if not FLAGS.dont_show:
+        cv2.imshow("Output Video", result)
+
+    # if output flag is set, save video file
+    if FLAGS.output:
+        out.write(result)
+    return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+
+def _stage_worker(fn, in_queue, out_queue, errors, stop):
+    """Apply `fn` to every item of `in_queue` in order and pass the results
+    on to `out_queue`. A `None` item marks the end of the stream. Once `stop`
+    is set, the remaining items are dropped until the end of the stream.
+    """
+    try:
+        while True:
+            item = in_queue.get()
+            if item is None:
+                break
+            if stop.is_set():
+                continue
+            try:
+                result = fn(item)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                continue
+            out_queue.put(result)
+    finally:
+        out_queue.put(None)
+
+
+def run_pipeline(vid, stages, consume, queue_size):
+    """Run `stages` in one worker thread each, connected by bounded queues.
+
+    Frames read from `vid` flow through the stages in order, so every stage
+    sees the frames in capture order. `consume` is called on the main thread
+    with the output of the last stage and returns False to stop early.
+
+    Returns True if all frames of `vid` have been consumed. All threads have
+    finished when this function returns, so the caller can release the video,
+    the writers and the encoder.
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def decode():
+        frame_num = 0
+        try:
+            while not stop.is_set():
+                return_value, frame = vid.read()
+                if not return_value:
+                    print('Video has ended or failed, try a different video format!')
+                    break
+                frame_num += 1
+                queues[0].put((frame_num, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+        finally:
+            queues[0].put(None)
+
+    threads = [threading.Thread(target=decode, daemon=True)]
+    for i, fn in enumerate(stages):
+        threads.append(threading.Thread(
+            target=_stage_worker, args=(fn, queues[i], queues[i + 1], errors, stop),
+            daemon=True))
+    for thread in threads:
+        thread.start()
+
+    finished = ended = False
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is None:
+                ended = True
+                finished = not stop.is_set()
+                break
+            if not consume(item):
+                break
+    finally:
+        # drain the queues until the end of the stream has passed every stage
+        stop.set()
+        while not ended:
+            ended = queues[-1].get() is None
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return finished
+
+
+def close_windows():
+    # headless OpenCV builds have no GUI support and raise here
+    if not FLAGS.headless:
+        cv2.destroyAllWindows()
+
+
+def open_video(video_path):
+    try:
+        return cv2.VideoCapture(int(video_path))
+    except:
+        return cv2.VideoCapture(video_path)
+
+
+def create_video_writer(vid, output_path):
+    # by default VideoCapture returns float instead of int
+    width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = int(vid.get(cv2.CAP_PROP_FPS))
+    codec = cv2.VideoWriter_fourcc(*FLAGS.output_format)
+    return cv2.VideoWriter(output_path, codec, fps, (width, height))
+
+
+def source_path(path, index):
+    """Returns the output path of a single source, e.g. demo.avi -> demo_0.avi"""
+    root, ext = os.path.splitext(path)
+    return "%s_%d%s" % (root, index, ext)
+
+
+def close_encoder(encoder):
+    if not isinstance(encoder, EncoderService):
+        return
+    encoder.close()
+    stats = encoder.stats()
+    print("Encoder service: {} batches, {:.1f} crops per batch, {:.0%} occupancy, {:.2f} ms mean queue wait".format(
+        stats['batches'], stats['mean_batch_size'], stats['occupancy'], stats['mean_queue_wait_ms']))
+
+
+def create_track_writer(path):
+    if not path:
+        return None
+    return TrackWriter(path, FLAGS.tracks_format)
+
+
+def run_multi_source(video_paths, detect, encoder, create_tracker, input_size,
+                     class_names, allowed_classes, colors, nms_max_overlap):
+    """Track several video sources at once.
+
+    Every iteration reads one frame from each source that is still running,
+    stacks them into a single batch for the detector and hands the results
+    back to one tracker per source.
+    """
+    sources, track_writers = [], []
+    for i, video_path in enumerate(video_paths):
+        vid = open_video(video_path)
+        out = None
+        # save one output video per source
+        if FLAGS.output and not FLAGS.headless:
+            out = create_video_writer(vid, source_path(FLAGS.output, i))
+        track_writer = None
+        if FLAGS.tracks_output:
+            track_writer = create_track_writer(source_path(FLAGS.tracks_output, i))
+            track_writers.append(track_writer)
+        sources.append({'index': i, 'vid': vid, 'out': out, 'tracker': create_tracker(),
+                        'track_writer': track_writer})
+
+    frame_num = 0
+    total_time = 0.
+    try:
+        while sources:
+            frames, active = [], []
+            for source in sources:
+                return_value, frame = source['vid'].read()
+                if not return_value:
+                    print('Video {} has ended or failed, try a different video format!'.format(source['index']))
+                    continue
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                active.append(source)
+            sources = active
+            if not sources:
+                break
+            frame_num +=1
+            if not FLAGS.headless:
+                print('Frame #: ', frame_num)
+            start_time = time.time()
+
+            # one forward pass for the frames of all sources
+            image_data = np.concatenate([preprocess(frame, input_size) for frame in frames], axis=0)
+            predictions = detect(image_data)
+
+            results = []
+            for frame, pred in zip(frames, predictions):
+                bboxes, scores, names = postprocess(pred, frame, class_names, allowed_classes)
+                results.append((bboxes, scores, names, submit_encode(encoder, frame, bboxes)))
+
+            for source, frame, (bboxes, scores, names, features) in zip(sources, frames, results):
+                if isinstance(features, Future):
+                    features = features.result()
+                detections = create_detections(bboxes, scores, names, features, nms_max_overlap)
+
+                tracker = source['tracker']
+                tracker.predict()
+                tracker.update(detections, create_feature_fn(encoder, frame), FLAGS.lazy_reid)
+                if source['track_writer'] is not None:
+                    source['track_writer'].write(frame_num, tracker.tracks)
+                if FLAGS.headless:
+                    continue
+
+                result = draw_tracks(frame, confirmed_tracks(tracker), colors, len(names))
+                if not FLAGS.dont_show:
+                    cv2.imshow("Output Video {}".format(source['index']), result)
+                if source['out'] is not None:
+                    source['out'].write(result)
+
+            total_time += time.time() - start_time
+            if FLAGS.headless:
+                continue
+            # calculate frames per second of running detections over all sources
+            fps = len(frames) / (time.time() - start_time)
+            print("FPS: %.2f" % fps)
+            if cv2.waitKey(1) & 0xFF == ord('q'): break
+    finally:
+        # also close the writers of sources that have already ended
+        for track_writer in track_writers:
+            track_writer.close()
+    if FLAGS.headless and frame_num > 0:
+        print("Processed {} frames per source at {:.2f} FPS".format(frame_num, frame_num / total_time))
+
+
+def run_cached(cached, vid, tracker, encoder, class_names, colors, out, track_writer):
+    """Track the cached detections of a video. The detector does not run,
+    and the encoder only runs if no features have been cached. `vid` is None
+    if no frame has to be decoded, i.e., in headless mode with cached features.
+    """
+    frame_num = 0
+    total_time = 0.
+    for frame_num in range(1, cached.num_frames + 1):
+        frame = None
+        if vid is not None:
+            return_value, frame = vid.read()
+            if not return_value:
+                print('Video has ended or failed, try a different video format!')
+                break
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if not FLAGS.headless:
+            print('Frame #: ', frame_num)
+        start_time = time.time()
+
+        bboxes, scores, class_indices, features = cached.frame(frame_num)
+        names = [class_names[i] for i in class_indices]
+        feature_fn = None
+        if features is None:
+            features = encode(encoder, frame, bboxes)
+            feature_fn = create_feature_fn(encoder, frame)
+        detections = [Detection(bbox, score, class_name, feature) for bbox, score, class_name, feature in zip(bboxes, scores, names, features)]
+
+        # Call the tracker
+        tracker.predict()
+        tracker.update(detections, feature_fn, FLAGS.lazy_reid)
+        if track_writer is not None:
+            track_writer.write(frame_num, tracker.tracks)
+        if FLAGS.headless:
+            total_time += time.time() - start_time
+            continue
+
+        result = draw_tracks(frame, confirmed_tracks(tracker), colors, len(names))
+
+        # calculate frames per second of running the tracker
+        fps = 1.0 / max(time.time() - start_time, 1e-6)
+        print("FPS: %.2f" % fps)
+
+        if not show_and_write(result, out): break
+    if track_writer is not None:
+        track_writer.close()
+    if FLAGS.headless and frame_num > 0:
+        print("Processed {} frames at {:.2f} FPS".format(frame_num, frame_num / max(total_time, 1e-6)))
+
+
+def main(_argv):
+    # Definition of the parameters
+    max_cosine_distance = 0.4
+    nn_budget = 100
+    nms_max_overlap = 1.0
+
+    # initialize deep sort
+    model_filename = 'model_data/mars-small128.pb'
+    if FLAGS.encoder_service and not FLAGS.videos:
+        # a single source has one encoder request outstanding at a time, so
+        # every request would wait out --encoder_max_wait without batching
+        logging.warning('--encoder_service requires --videos and is ignored')
+    if FLAGS.encoder_service and FLAGS.videos:
+        # one service batches the encoder requests of all sources
+        encoder = EncoderService(gdet.ImageEncoder(model_filename), FLAGS.encoder_max_batch,
+                                 FLAGS.encoder_max_wait / 1000., FLAGS.cv2_crop)
+    else:
+        encoder = gdet.create_box_encoder(model_filename, batch_size=32, cv2_crop=FLAGS.cv2_crop)
+
+    def create_tracker():
+        # calculate cosine distance metric
+        metric = nn_matching.NearestNeighborDistanceMetric("cosine", max_cosine_distance, nn_budget)
+        # initialize tracker
+        embedding_cache = None
+        if FLAGS.embedding_cache:
+            # a non-positive IoU threshold disables the IoU criterion
+            min_iou = FLAGS.reuse_iou if FLAGS.reuse_iou > 0 else None
+            embedding_cache = EmbeddingCache(min_iou, FLAGS.reuse_pixels, FLAGS.reuse_max_age)
+        return Tracker(metric, feature_interval=FLAGS.feature_interval, embedding_cache=embedding_cache)
+    tracker = create_tracker()
+
+    # load configuration for object detector
+    config = ConfigProto()
+    config.gpu_options.allow_growth = True
+    session = InteractiveSession(config=config)
+    STRIDES, ANCHORS, NUM_CLASS, XYSCALE = utils.load_config(FLAGS)
+    input_size = FLAGS.size
+    video_path = FLAGS.video
+
+    # read in all class names from config
+    class_names = utils.read_class_names(cfg.YOLO.CLASSES)
+    if FLAGS.model_classes:
+        # class index k of a pruned model refers to its k-th class
+        class_names = dict(enumerate(FLAGS.model_classes))
+    class_ids = {name: class_id for class_id, name in class_names.items()}
+
+    # by default allow all classes in .names file
+    #allowed_classes = list(class_names.values())
+    allowed_classes = ALLOWED_CLASSES
+
+    # nothing is rendered in headless mode, all results go to the track records
+    colors = None
+    if FLAGS.headless:
+        if FLAGS.output:
+            logging.warning('--output is ignored in headless mode')
+    else:
+        #initialize color map
+        cmap = plt.get_cmap('tab20b')
+        colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
+
+    if FLAGS.videos:
+        if FLAGS.detection_cache:
+            logging.warning('--detection_cache only supports a single video file and is ignored')
+        if FLAGS.pipeline:
+            logging.warning('--pipeline only supports a single video source and is ignored')
+        run_multi_source(FLAGS.videos, create_detector(input_size), encoder, create_tracker, input_size,
+                         class_names, allowed_classes, colors, nms_max_overlap)
+        close_encoder(encoder)
+        close_windows()
+        return
+
+    # look up the detections of an earlier run on the same video with the
+    # same detector settings
+    cache_path, cached, recorder = None, None, None
+    if FLAGS.detection_cache:
+        if os.path.isfile(video_path):
+            settings = detector_settings(allowed_classes, nms_max_overlap)
+            cache_path, cached = open_cache(FLAGS.detection_cache, video_path, settings)
+            if cached is None:
+                # features computed on demand are incomplete and not cached
+                recorder = DetectionRecorder(cache_path, settings, not features_on_demand())
+        else:
+            logging.warning('--detection_cache requires a video file and is ignored')
+
+    # begin video capture, cached detections with features are tracked
+    # without decoding the video unless frames are rendered
+    vid = None
+    if cached is None or not cached.has_features or not FLAGS.headless:
+        vid = open_video(video_path)
+
+    out = None
+
+    # get video ready to save locally if flag is set
+    if FLAGS.output and not FLAGS.headless:
+        out = create_video_writer(vid, FLAGS.output)
+
+    track_writer = create_track_writer(FLAGS.tracks_output)
+
+    if cached is not None:
+        print('Tracking cached detections from {}'.format(cache_path))
+        run_cached(cached, vid, tracker, encoder, class_names, colors, out, track_writer)
+        if tracker.embedding_cache is not None:
+            print("Embedding cache hit rate: {:.1%}".format(tracker.embedding_cache.hit_rate))
+        close_encoder(encoder)
+        close_windows()
+        return
+
+    detect = create_detector(input_size)
+
+    if FLAGS.pipeline:
+        # every stage runs in its own thread and hands frames on in capture
+        # order, so the tracker still sees one frame after the other
+        def preprocess_stage(item):
+            frame_num, frame = item
+            return frame_num, frame, preprocess(frame, input_size)
+
+        def detect_stage(item):
+            frame_num, frame, image_data = item
+            pred, = detect(image_data)
+            bboxes, scores, names = postprocess(pred, frame, class_names, allowed_classes)
+            return frame_num, frame, bboxes, scores, names
+
+        def encode_stage(item):
+            frame_num, frame, bboxes, scores, names = item
+            features = encode(encoder, frame, bboxes)
+            return frame_num, frame, create_detections(bboxes, scores, names, features, nms_max_overlap), len(names)
+
+        def track_stage(item):
+            frame_num, frame, detections, count = item
+            if recorder is not None:
+                record_detections(recorder, frame_num, detections, class_ids)
+            tracker.predict()
+            tracker.update(detections, create_feature_fn(encoder, frame), FLAGS.lazy_reid)
+            if track_writer is not None:
+                track_writer.write(frame_num, tracker.tracks)
+            if FLAGS.headless:
+                return frame_num, None, None, count
+            return frame_num, frame, confirmed_tracks(tracker), count
+
+        last_time = [time.time()]
+        start_time = time.time()
+        frame_count = [0]
+
+        def render(item):
+            frame_num, frame, tracks, count = item
+            frame_count[0] = frame_num
+            if FLAGS.headless:
+                return True
+            print('Frame #: ', frame_num)
+            result = draw_tracks(frame, tracks, colors, count)
+            # frames per second of the whole pipeline, measured at its output
+            now = time.time()
+            print("FPS: %.2f" % (1.0 / max(now - last_time[0], 1e-6)))
+            last_time[0] = now
+            return show_and_write(result, out)
+
+        try:
+            finished = run_pipeline(vid, [preprocess_stage, detect_stage, encode_stage, track_stage], render, FLAGS.queue_size)
+        finally:
+            if track_writer is not None:
+                track_writer.close()
+            close_encoder(encoder)
+        # only cache the detections of the whole video
+        if recorder is not None:
+            if finished and frame_count[0] > 0:
+                recorder.close(frame_count[0])
+            else:
+                recorder.discard()
+        if FLAGS.headless and frame_count[0] > 0:
+            print("Processed {} frames at {:.2f} FPS".format(frame_count[0], frame_count[0] / (time.time() - start_time)))
+        close_windows()
+        return
+
+    frame_num = 0
+    total_time = 0.
+    finished = False
+    # while video is running
+    while True:
+        return_value, frame = vid.read()
+        if return_value:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        else:
+            print('Video has ended or failed, try a different video format!')
+            finished = True
+            break
+        frame_num +=1
+        if not FLAGS.headless:
+            print('Frame #: ', frame_num)
+        image_data = preprocess(frame, input_size)
+        start_time = time.time()
+
+        pred, = detect(image_data)
+        bboxes, scores, names = postprocess(pred, frame, class_names, allowed_classes)
+
+        # encode yolo detections and feed to tracker
+        features = encode(encoder, frame, bboxes)
+        detections = create_detections(bboxes, scores, names, features, nms_max_overlap)
+        if recorder is not None:
+            record_detections(recorder, frame_num, detections, class_ids)
+
+        # Call the tracker
+        tracker.predict()
+        tracker.update(detections, create_feature_fn(encoder, frame), FLAGS.lazy_reid)
+        if track_writer is not None:
+            track_writer.write(frame_num, tracker.tracks)
+        if FLAGS.headless:
+            total_time += time.time() - start_time
+            continue
+
+        result = draw_tracks(frame, confirmed_tracks(tracker), colors, len(names))
+
+        # calculate frames per second of running detections
+        fps = 1.0 / (time.time() - start_time)
+        print("FPS: %.2f" % fps)
+
+        if not show_and_write(result, out): break
+    if track_writer is not None:
+        track_writer.close()
+    # only cache the detections of the whole video
+    if recorder is not None:
+        if finished and frame_num > 0:
+            recorder.close(frame_num)
+        else:
+            recorder.discard()
+    if FLAGS.headless and frame_num > 0:
+        print("Processed {} frames at {:.2f} FPS".format(frame_num, frame_num / total_time))
+    if tracker.embedding_cache is not None:
+        print("Embedding cache hit rate: {:.1%}".format(tracker.embedding_cache.hit_rate))
+    close_encoder(encoder)
+    close_windows()
+
+if __name__ == '__main__':
+    try:
+        app.run(main)
+    except SystemExit:
+        pass
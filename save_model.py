@@ -1,7 +1,7 @@
 import tensorflow as tf
 from absl import app, flags, logging
 from absl.flags import FLAGS
-from core.yolov4 import YOLO, decode, filter_boxes
+from core.yolov4 import YOLO, decode, filter_boxes, filter_boxes_top_k, combined_nms
 import core.utils as utils
 from core.config import cfg
 
@@ -12,9 +12,43 @@ flags.DEFINE_integer('input_size', 416, 'define input size of export model')
 flags.DEFINE_float('score_thres', 0.2, 'define score threshold')
 flags.DEFINE_string('framework', 'tf', 'define what framework do you want to convert (tf, trt, tflite)')
 flags.DEFINE_string('model', 'yolov4', 'yolov3 or yolov4')
+flags.DEFINE_boolean('nms', False, 'bake class filtering, score threshold and non-maxima suppression into the exported model (tf, trt)')
+flags.DEFINE_list('classes', None, 'class names kept by the exported model, its decode stage and non-maxima suppression only compute these classes; all classes if not set')
+flags.DEFINE_float('iou_thres', 0.45, 'define iou threshold of the non-maxima suppression exported with --nms')
+flags.DEFINE_integer('max_detections', 50, 'maximum number of detections per image returned by the model exported with --nms')
+flags.DEFINE_integer('top_k', 0, 'keep a fixed number of candidates per image by max class score, which makes the exported model batch-safe and bounds the NMS input; disabled if 0 (tf, trt)')
+
+def class_ids(class_names):
+  names = utils.read_class_names(cfg.YOLO.CLASSES)
+  ids = {name: i for i, name in names.items()}
+  unknown = [name for name in class_names if name not in ids]
+  if unknown:
+    raise ValueError('unknown classes: {}'.format(', '.join(unknown)))
+  return [ids[name] for name in class_names]
+
+def serving_signature(model, kept_ids):
+  # the serving signature returns fixed-size outputs per image: the final
+  # detections with the original class indices if --nms is set, otherwise the
+  # top_k candidates and the number of valid candidates
+  input_shape = tf.constant([FLAGS.input_size, FLAGS.input_size])
+
+  @tf.function(input_signature=[tf.TensorSpec([None, FLAGS.input_size, FLAGS.input_size, 3], tf.float32)])
+  def serve(images):
+    pred_bbox, pred_prob = model(images, training=False)
+    if FLAGS.nms:
+      boxes, scores, classes, valid_detections = combined_nms(
+        pred_bbox, pred_prob, input_shape, score_threshold=FLAGS.score_thres, iou_threshold=FLAGS.iou_thres,
+        max_total_size=FLAGS.max_detections, class_ids=kept_ids, top_k=FLAGS.top_k)
+      return {'boxes': boxes, 'scores': scores, 'classes': classes, 'valid_detections': valid_detections}
+    boxes, pred_conf, valid_counts = filter_boxes_top_k(
+      pred_bbox, pred_prob, score_threshold=FLAGS.score_thres, input_shape=input_shape, top_k=FLAGS.top_k)
+    return {'boxes': boxes, 'pred_conf': pred_conf, 'valid_counts': valid_counts}
+  return serve
 
 def save_tf():
   STRIDES, ANCHORS, NUM_CLASS, XYSCALE = utils.load_config(FLAGS)
+  # the head keeps all classes so the darknet weights load, decoding prunes
+  kept_ids = class_ids(FLAGS.classes) if FLAGS.classes else None
 
   input_layer = tf.keras.layers.Input([FLAGS.input_size, FLAGS.input_size, 3])
   feature_maps = YOLO(input_layer, NUM_CLASS, FLAGS.model, FLAGS.tiny)
@@ -23,24 +57,30 @@ def save_tf():
   if FLAGS.tiny:
     for i, fm in enumerate(feature_maps):
       if i == 0:
-        output_tensors = decode(fm, FLAGS.input_size // 16, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework)
+        output_tensors = decode(fm, FLAGS.input_size // 16, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework, kept_ids)
       else:
-        output_tensors = decode(fm, FLAGS.input_size // 32, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework)
+        output_tensors = decode(fm, FLAGS.input_size // 32, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework, kept_ids)
       bbox_tensors.append(output_tensors[0])
       prob_tensors.append(output_tensors[1])
   else:
     for i, fm in enumerate(feature_maps):
       if i == 0:
-        output_tensors = decode(fm, FLAGS.input_size // 8, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework)
+        output_tensors = decode(fm, FLAGS.input_size // 8, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework, kept_ids)
       elif i == 1:
-        output_tensors = decode(fm, FLAGS.input_size // 16, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework)
+        output_tensors = decode(fm, FLAGS.input_size // 16, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework, kept_ids)
       else:
-        output_tensors = decode(fm, FLAGS.input_size // 32, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework)
+        output_tensors = decode(fm, FLAGS.input_size // 32, NUM_CLASS, STRIDES, ANCHORS, i, XYSCALE, FLAGS.framework, kept_ids)
       bbox_tensors.append(output_tensors[0])
       prob_tensors.append(output_tensors[1])
   pred_bbox = tf.concat(bbox_tensors, axis=1)
   pred_prob = tf.concat(prob_tensors, axis=1)
-  if FLAGS.framework == 'tflite':
+  nms = FLAGS.nms and FLAGS.framework != 'tflite'
+  if FLAGS.nms and not nms:
+    logging.warning('--nms is not supported for tflite and is ignored')
+  top_k = FLAGS.top_k > 0 and FLAGS.framework != 'tflite'
+  if FLAGS.top_k > 0 and not top_k:
+    logging.warning('--top_k is applied by object_tracker.py for tflite models and is ignored')
+  if FLAGS.framework == 'tflite' or nms or top_k:
     pred = (pred_bbox, pred_prob)
   else:
     boxes, pred_conf = filter_boxes(pred_bbox, pred_prob, score_threshold=FLAGS.score_thres, input_shape=tf.constant([FLAGS.input_size, FLAGS.input_size]))
@@ -48,7 +88,10 @@ def save_tf():
   model = tf.keras.Model(input_layer, pred)
   utils.load_weights(model, FLAGS.weights, FLAGS.model, FLAGS.tiny)
   model.summary()
-  model.save(FLAGS.output)
+  if nms or top_k:
+    model.save(FLAGS.output, signatures=serving_signature(model, kept_ids))
+  else:
+    model.save(FLAGS.output)
 
 def main(_argv):
   save_tf()
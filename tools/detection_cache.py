@@ -0,0 +1,220 @@
+# vim: expandtab:ts=4:sw=4
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+from tools.detection_store import (
+    DetectionStore, DetectionStoreWriter, is_detection_store)
+
+
+METADATA_FILENAME = "cache.json"
+
+# Detection rows follow the MOTChallenge layout of the detection store. The
+# class index is kept in the otherwise unused first world coordinate.
+CLASS_COLUMN = 7
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """Returns the SHA-1 hex digest of the contents of a file."""
+    digest = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(video_filename, settings):
+    """Compute the key of the cached detections of a video.
+
+    Parameters
+    ----------
+    video_filename : str
+        Path to the video file. The key depends on the file contents, not on
+        its name.
+    settings : Dict[str, object]
+        JSON serializable detector settings that the detections depend on,
+        e.g., weights, input size and thresholds.
+
+    Returns
+    -------
+    str
+        A hex digest that identifies video and settings.
+
+    """
+    digest = hashlib.sha1(file_digest(video_filename).encode("ascii"))
+    digest.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class CachedDetections(object):
+    """
+    Detections of a video that have been recorded by `DetectionRecorder`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the cache entry.
+
+    Attributes
+    ----------
+    store : tools.detection_store.DetectionStore
+        The memory-mapped detections.
+    num_frames : int
+        Number of frames of the video, including frames without detections.
+    settings : Dict[str, object]
+        The detector settings the detections have been recorded with.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.store = DetectionStore(path)
+        with open(os.path.join(path, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+        self.num_frames = metadata["num_frames"]
+        self.settings = metadata["settings"]
+
+    @property
+    def has_features(self):
+        return self.store.feature_dim > 0
+
+    def frame(self, frame_idx):
+        """Get the detections of a frame.
+
+        Returns
+        -------
+        (ndarray, ndarray, ndarray, Optional[ndarray])
+            Returns the bounding boxes in format (x, y, width, height), the
+            detector confidences, the class indices and the appearance
+            features, or None if no features have been recorded.
+
+        """
+        rows, features = self.store.frame(frame_idx)
+        features = features.astype(np.float32) if self.has_features else None
+        return (rows[:, 2:6].astype(np.float64), rows[:, 6],
+                rows[:, CLASS_COLUMN].astype(np.int64), features)
+
+
+class DetectionRecorder(object):
+    """
+    Records the detections of a video frame by frame and stores them as a
+    cache entry once the whole video has been processed. The detections are
+    streamed to a temporary directory as they arrive, so memory use does not
+    grow with the length of the video. The directory is renamed when
+    complete, so a run that is stopped early never leaves a partial entry
+    behind.
+
+    Parameters
+    ----------
+    path : str
+        Path to the cache entry.
+    settings : Dict[str, object]
+        The detector settings, stored alongside the detections.
+    with_features : bool
+        If True, the appearance features of the detections are recorded too.
+
+    """
+
+    def __init__(self, path, settings, with_features):
+        self.path = path
+        self.settings = settings
+        self.with_features = with_features
+        self._tmp_path = path + ".tmp"
+        self._writer = None
+
+    def _open(self, feature_dim):
+        if os.path.isdir(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+        return DetectionStoreWriter(self._tmp_path, None, 10, feature_dim)
+
+    def add(self, frame_idx, bboxes, scores, class_ids, features=None):
+        """Record the detections of a frame.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+        bboxes : array_like
+            The Nx4 bounding boxes in format (x, y, width, height).
+        scores : array_like
+            The N detector confidences.
+        class_ids : array_like
+            The N class indices.
+        features : Optional[array_like]
+            The NxM appearance features. Only used if the recorder has been
+            created with `with_features`.
+
+        """
+        if len(scores) == 0:
+            return
+        rows = np.full((len(scores), 10), -1, dtype=np.float32)
+        rows[:, 0] = frame_idx
+        rows[:, 2:6] = bboxes
+        rows[:, 6] = scores
+        rows[:, CLASS_COLUMN] = class_ids
+        if self.with_features:
+            features = np.asarray(
+                features, dtype=np.float16).reshape(len(rows), -1)
+        else:
+            features = np.zeros((len(rows), 0), dtype=np.float16)
+        if self._writer is None:
+            self._writer = self._open(features.shape[1])
+        self._writer.append(frame_idx, rows, features)
+
+    def close(self, num_frames):
+        """Write the cache entry.
+
+        Parameters
+        ----------
+        num_frames : int
+            Number of frames of the video.
+
+        """
+        if self._writer is None:
+            self._writer = self._open(0)
+        self._writer.close()
+        self._writer = None
+        with open(os.path.join(self._tmp_path, METADATA_FILENAME), "w") as f:
+            json.dump({"num_frames": num_frames, "settings": self.settings}, f)
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self._tmp_path, self.path)
+
+    def discard(self):
+        """Remove the detections recorded so far without writing the cache
+        entry, e.g., if the run has been stopped early.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.isdir(self._tmp_path):
+            shutil.rmtree(self._tmp_path)
+
+
+def open_cache(cache_dir, video_filename, settings):
+    """Look up the cached detections of a video.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The cache directory.
+    video_filename : str
+        Path to the video file.
+    settings : Dict[str, object]
+        The detector settings, see `cache_key`.
+
+    Returns
+    -------
+    (str, Optional[CachedDetections])
+        Returns the path to the cache entry and the cached detections, or
+        None if the entry does not exist yet.
+
+    """
+    path = os.path.join(cache_dir, cache_key(video_filename, settings))
+    if is_detection_store(path) and os.path.isfile(
+            os.path.join(path, METADATA_FILENAME)):
+        return path, CachedDetections(path)
+    return path, None
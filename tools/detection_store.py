@@ -0,0 +1,258 @@
+# vim: expandtab:ts=4:sw=4
+import os
+import io
+import errno
+
+import numpy as np
+
+
+ROWS_FILENAME = "rows.npy"
+FEATURES_FILENAME = "features.npy"
+OFFSETS_FILENAME = "offsets.npy"
+
+
+class DetectionStoreWriter(object):
+    """
+    Writes a detection store incrementally, one frame after the other.
+
+    A detection store is a directory with three memory-mappable files:
+
+    * `rows.npy`: float32 detection rows in MOTChallenge format
+      `(frame, id, x, y, w, h, confidence, x, y, z)`, sorted by frame.
+    * `features.npy`: float16 appearance features, one per row.
+    * `offsets.npy`: int64 offsets into the rows, such that the detections
+      of frame k are stored in rows `offsets[k]` to `offsets[k + 1]`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the store directory. Will be created if it does not exist.
+    capacity : Optional[int]
+        Maximum number of detections. If None, the files are grown as
+        detections are appended, e.g., for a video of unknown length.
+    row_dim : int
+        Number of columns of a detection row.
+    feature_dim : int
+        Dimensionality of the appearance features.
+
+    """
+
+    def __init__(self, path, capacity, row_dim, feature_dim):
+        try:
+            os.makedirs(path)
+        except OSError as exception:
+            if exception.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+        self.path = path
+        self._growable = capacity is None
+        if capacity is None:
+            capacity = 1024
+        self._rows = np.lib.format.open_memmap(
+            os.path.join(path, ROWS_FILENAME), mode="w+", dtype=np.float32,
+            shape=(capacity, row_dim))
+        self._features = np.lib.format.open_memmap(
+            os.path.join(path, FEATURES_FILENAME), mode="w+",
+            dtype=np.float16, shape=(capacity, feature_dim))
+        self._frame_indices = []
+        self._frame_ends = []
+        self._num_rows = 0
+
+    def append(self, frame_idx, rows, features):
+        """Append the detections of a frame. Frames must be appended in
+        increasing order.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+        rows : ndarray
+            The detection rows of this frame.
+        features : ndarray
+            The appearance features of this frame, one per row.
+
+        """
+        if self._frame_indices and frame_idx <= self._frame_indices[-1]:
+            raise ValueError("Frames must be appended in increasing order")
+        end = self._num_rows + len(rows)
+        if end > len(self._rows) and self._growable:
+            self._grow(max(end, 2 * len(self._rows)))
+        self._rows[self._num_rows:end] = rows
+        self._features[self._num_rows:end] = features
+        self._num_rows = end
+        self._frame_indices.append(int(frame_idx))
+        self._frame_ends.append(end)
+
+    def _grow(self, capacity):
+        # Copy the rows written so far into larger files. The copy goes
+        # through the page cache, the detections are never held in memory.
+        for name, filename in (("_rows", ROWS_FILENAME),
+                               ("_features", FEATURES_FILENAME)):
+            path = os.path.join(self.path, filename)
+            data = getattr(self, name)
+            grown = np.lib.format.open_memmap(
+                path + ".tmp", mode="w+", dtype=data.dtype,
+                shape=(capacity, ) + data.shape[1:])
+            grown[:self._num_rows] = data[:self._num_rows]
+            grown.flush()
+            del data, grown
+            setattr(self, name, None)
+            os.replace(path + ".tmp", path)
+            setattr(self, name, np.load(path, mmap_mode="r+"))
+
+    def close(self):
+        """Flush all data and write the frame index."""
+        num_rows = self._num_rows
+        rows, features = self._rows, self._features
+        rows.flush()
+        features.flush()
+        del self._rows, self._features
+        if num_rows < len(rows):
+            # Truncate to the number of rows that have been written.
+            _truncate(os.path.join(self.path, ROWS_FILENAME), num_rows)
+            _truncate(os.path.join(self.path, FEATURES_FILENAME), num_rows)
+
+        num_frames = self._frame_indices[-1] + 1 if self._frame_indices else 0
+        offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        # Frames without detections get an empty range.
+        ends = np.zeros(num_frames, dtype=np.int64)
+        ends[self._frame_indices] = self._frame_ends
+        offsets[1:] = np.maximum.accumulate(ends)
+        np.save(os.path.join(self.path, OFFSETS_FILENAME), offsets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _truncate(filename, num_rows):
+    # Rewrite the header with the new shape and cut off the unused rows. If
+    # the new header does not fit, the rows are copied to a new file.
+    data = np.load(filename, mmap_mode="r")
+    shape = (num_rows, ) + data.shape[1:]
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, {
+        "descr": np.lib.format.dtype_to_descr(data.dtype),
+        "fortran_order": False, "shape": shape})
+    if header.tell() == data.offset:
+        row_size = data.dtype.itemsize * int(np.prod(data.shape[1:]))
+        size = data.offset + num_rows * row_size
+        del data
+        with open(filename, "r+b") as f:
+            f.write(header.getvalue())
+            f.truncate(size)
+        return
+    truncated = np.lib.format.open_memmap(
+        filename + ".tmp", mode="w+", dtype=data.dtype, shape=shape)
+    truncated[:] = data[:num_rows]
+    truncated.flush()
+    del data, truncated
+    os.replace(filename + ".tmp", filename)
+
+
+def write_detection_store(path, rows, features):
+    """Write a detection store from in-memory arrays.
+
+    Parameters
+    ----------
+    path : str
+        Path to the store directory.
+    rows : ndarray
+        The NxK matrix of detection rows in MOTChallenge format.
+    features : ndarray
+        The NxM matrix of appearance features.
+
+    """
+    order = np.argsort(rows[:, 0], kind="stable")
+    rows, features = rows[order], features[order]
+    frame_indices = rows[:, 0].astype(np.int64)
+    with DetectionStoreWriter(
+            path, len(rows), rows.shape[1], features.shape[1]) as writer:
+        frames, starts = np.unique(frame_indices, return_index=True)
+        ends = np.r_[starts[1:], len(rows)]
+        for frame_idx, start, end in zip(frames, starts, ends):
+            writer.append(frame_idx, rows[start:end], features[start:end])
+
+
+class DetectionStore(object):
+    """
+    Read-only, memory-mapped access to a detection store written by
+    `DetectionStoreWriter`. Opening a store does not read the detections;
+    the detections of a single frame are fetched in O(1).
+
+    Parameters
+    ----------
+    path : str
+        Path to the store directory.
+
+    Attributes
+    ----------
+    rows : ndarray
+        Memory-mapped float32 detection rows of all frames.
+    features : ndarray
+        Memory-mapped float16 appearance features of all frames.
+    offsets : ndarray
+        The frame index, see `DetectionStoreWriter`.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = np.load(
+            os.path.join(path, ROWS_FILENAME), mmap_mode="r")
+        self.features = np.load(
+            os.path.join(path, FEATURES_FILENAME), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILENAME))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def feature_dim(self):
+        return self.features.shape[1]
+
+    @property
+    def min_frame_idx(self):
+        """The first frame that has detections, -1 if the store is empty."""
+        nonempty = np.flatnonzero(np.diff(self.offsets))
+        return int(nonempty[0]) if len(nonempty) > 0 else -1
+
+    @property
+    def max_frame_idx(self):
+        """The last frame that has detections, -1 if the store is empty."""
+        return len(self.offsets) - 2
+
+    def frame(self, frame_idx):
+        """Get the detections of a single frame.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the detection rows and the appearance features of the
+            frame as read-only views into the store. Both are empty if the
+            frame has no detections.
+
+        """
+        if frame_idx < 0 or frame_idx + 1 >= len(self.offsets):
+            return self.rows[:0], self.features[:0]
+        start, end = self.offsets[frame_idx], self.offsets[frame_idx + 1]
+        return self.rows[start:end], self.features[start:end]
+
+    def frame_array(self, frame_idx):
+        """Get the detections of a single frame as one float32 matrix in the
+        layout of the .npy files written by `generate_detections`, i.e., the
+        detection row followed by the feature.
+        """
+        rows, features = self.frame(frame_idx)
+        return np.hstack((rows, features.astype(np.float32)))
+
+
+def is_detection_store(path):
+    """Returns True if `path` is a detection store directory."""
+    return os.path.isfile(os.path.join(path, OFFSETS_FILENAME))
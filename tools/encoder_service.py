@@ -0,0 +1,237 @@
+# vim: expandtab:ts=4:sw=4
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from tools.generate_detections import crop_boxes, extract_image_patches
+
+
+# Upper bounds of the histogram bins, the last bin is open ended.
+BATCH_SIZE_BINS = (1, 2, 4, 8, 16, 32, 64, 128)
+WAIT_MS_BINS = (0.5, 1., 2., 5., 10., 20., 50., 100.)
+
+
+class Histogram(object):
+    """
+    A fixed-bin histogram counter.
+
+    Parameters
+    ----------
+    bounds : Tuple[float]
+        Sorted upper bounds (inclusive) of the bins. Values above the last
+        bound fall into an additional overflow bin.
+
+    Attributes
+    ----------
+    counts : ndarray
+        Number of values per bin, one more than there are bounds.
+    total : float
+        Sum of all values.
+
+    """
+
+    def __init__(self, bounds):
+        self.bounds = np.asarray(bounds, dtype=np.float64)
+        self.counts = np.zeros(len(bounds) + 1, dtype=np.int64)
+        self.total = 0.
+
+    def add(self, value):
+        self.counts[np.searchsorted(self.bounds, value, side="left")] += 1
+        self.total += value
+
+    @property
+    def mean(self):
+        count = int(self.counts.sum())
+        return self.total / count if count > 0 else 0.
+
+    def as_dict(self):
+        labels = ["<=%g" % b for b in self.bounds] + [">%g" % self.bounds[-1]]
+        return dict(zip(labels, self.counts.tolist()))
+
+
+class EncoderService(object):
+    """
+    Micro-batching front end for a shared `ImageEncoder`.
+
+    Trackers and threads submit the boxes of a frame and get a future for the
+    features back. A background thread collects the crops of pending requests
+    and runs the encoder network once per batch. A batch is flushed when it
+    holds `max_batch_size` crops or when its oldest request has waited for
+    `max_wait` seconds.
+
+    Parameters
+    ----------
+    image_encoder : tools.generate_detections.ImageEncoder
+        The encoder that crops and encodes image patches.
+    max_batch_size : int
+        Maximum number of crops per network run. A single request with more
+        crops is run on its own.
+    max_wait : float
+        Maximum time in seconds a request waits for others to share its batch.
+    cv2_crop : bool
+        If True, image patches are cropped on the host with OpenCV instead of
+        on the encoder graph, see `generate_detections.create_box_encoder`.
+
+    Attributes
+    ----------
+    num_requests : int
+        Number of requests served.
+    num_crops : int
+        Number of crops encoded.
+    num_batches : int
+        Number of network runs.
+    batch_sizes : Histogram
+        Number of crops per network run.
+    queue_wait_ms : Histogram
+        Time in milliseconds between submission of a request and the start of
+        the network run that serves it.
+
+    """
+
+    def __init__(self, image_encoder, max_batch_size=64, max_wait=0.005,
+                 cv2_crop=False):
+        self.image_encoder = image_encoder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cv2_crop = cv2_crop
+
+        self.num_requests = 0
+        self.num_crops = 0
+        self.num_batches = 0
+        self.num_padded = 0
+        self.batch_sizes = Histogram(BATCH_SIZE_BINS)
+        self.queue_wait_ms = Histogram(WAIT_MS_BINS)
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    @property
+    def occupancy(self):
+        """Fraction of the padded network batches filled with crops."""
+        return self.num_crops / self.num_padded if self.num_padded > 0 else 0.
+
+    def stats(self):
+        """Returns a snapshot of all counters."""
+        return {
+            "requests": self.num_requests,
+            "crops": self.num_crops,
+            "batches": self.num_batches,
+            "occupancy": self.occupancy,
+            "mean_batch_size": self.batch_sizes.mean,
+            "mean_queue_wait_ms": self.queue_wait_ms.mean,
+            "batch_sizes": self.batch_sizes.as_dict(),
+            "queue_wait_ms": self.queue_wait_ms.as_dict()}
+
+    def submit(self, image, boxes):
+        """Request the features of the given boxes.
+
+        Parameters
+        ----------
+        image : ndarray
+            The full image.
+        boxes : array_like
+            An Nx4 matrix of bounding boxes in format (x, y, width, height).
+
+        Returns
+        -------
+        concurrent.futures.Future
+            A future of the NxM matrix of features.
+
+        """
+        future = Future()
+        if self.cv2_crop:
+            # boxes are cropped as they are in the service thread
+            request_boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        else:
+            request_boxes, valid = crop_boxes(
+                image.shape, boxes, self.image_encoder.image_shape[:2])
+            for box in np.asarray(boxes)[~valid]:
+                print("WARNING: Failed to extract image patch: %s." % str(box))
+        if len(request_boxes) == 0:
+            future.set_result(
+                np.zeros((0, self.image_encoder.feature_dim), np.float32))
+            return future
+        self._queue.put((time.time(), image, request_boxes, future))
+        return future
+
+    def __call__(self, image, boxes):
+        """Blocking version of `submit` with the interface of the encoder
+        returned by `generate_detections.create_box_encoder`.
+        """
+        return self.submit(image, boxes).result()
+
+    def close(self):
+        """Serve all pending requests and stop the background thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _serve(self):
+        pending = None
+        while True:
+            request = pending if pending is not None else self._queue.get()
+            pending = None
+            if request is None:
+                return
+
+            # Collect requests until the batch is full or the oldest request
+            # reaches its deadline.
+            batch, num_crops = [request], len(request[2])
+            deadline = request[0] + self.max_wait
+            stop = False
+            while num_crops < self.max_batch_size:
+                try:
+                    request = self._queue.get(
+                        timeout=max(0., deadline - time.time()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                if num_crops + len(request[2]) > self.max_batch_size:
+                    pending = request
+                    break
+                batch.append(request)
+                num_crops += len(request[2])
+
+            self._run(batch, num_crops)
+            if stop:
+                return
+
+    def _crop(self, image, boxes):
+        if self.cv2_crop:
+            return extract_image_patches(
+                image, boxes, self.image_encoder.image_shape)
+        return self.image_encoder.crop_patches(image, boxes)
+
+    def _run(self, batch, num_crops):
+        start = time.time()
+        try:
+            patches = np.concatenate([
+                self._crop(image, boxes) for _, image, boxes, _ in batch])
+            features = self.image_encoder(
+                patches, batch_size=max(self.max_batch_size, num_crops))
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        self.num_crops += num_crops
+        self.num_padded += self.image_encoder.bucket_size(num_crops)
+        self.batch_sizes.add(num_crops)
+        offset = 0
+        for submitted, _, boxes, future in batch:
+            self.queue_wait_ms.add(1000. * (start - submitted))
+            future.set_result(features[offset:offset + len(boxes)])
+            offset += len(boxes)
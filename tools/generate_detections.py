@@ -2,11 +2,18 @@
 import os
 import errno
 import argparse
+import collections
+import multiprocessing
+from concurrent.futures import (
+    ProcessPoolExecutor, ThreadPoolExecutor, as_completed)
 import numpy as np
 import cv2
-import tensorflow.compat.v1 as tf
-
-#tf.compat.v1.disable_eager_execution()
+import tensorflow as tf
+try:
+    from tools.detection_store import DetectionStoreWriter
+except ImportError:
+    # run as a script, e.g. python tools/generate_detections.py
+    from detection_store import DetectionStoreWriter
 
 physical_devices = tf.config.experimental.list_physical_devices('GPU')
 if len(physical_devices) > 0:
@@ -73,54 +80,412 @@ def extract_image_patch(image, bbox, patch_shape):
     return image
 
 
+def extract_image_patches(image, bboxes, patch_shape):
+    """Extract the image patches of several bounding boxes on the host with
+    `extract_image_patch`. Boxes without image content get a patch of
+    uniform noise.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    bboxes : array_like
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    patch_shape : array_like
+        The patch shape (height, width, channels).
+
+    Returns
+    -------
+    ndarray
+        Returns the uint8 image patches of shape N x `patch_shape`.
+
+    """
+    patches = []
+    for box in bboxes:
+        patch = extract_image_patch(image, box, patch_shape[:2])
+        if patch is None:
+            print("WARNING: Failed to extract image patch: %s." % str(box))
+            patch = np.random.uniform(
+                0., 255., patch_shape).astype(np.uint8)
+        patches.append(patch)
+    return np.asarray(patches, dtype=np.uint8).reshape(
+        (-1, ) + tuple(patch_shape))
+
+
+def crop_boxes(image_shape, bboxes, patch_shape):
+    """Vectorized version of the box computation of `extract_image_patch`.
+
+    Parameters
+    ----------
+    image_shape : array_like
+        The shape (height, width, ...) of the full image.
+    bboxes : array_like
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    patch_shape : array_like
+        The patch shape (height, width). The boxes are adapted to its aspect
+        ratio, then clipped at the image boundaries.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the Nx4 matrix of crop boxes in normalized format
+        (y1, x1, y2, x2) as expected by `tf.image.crop_and_resize` and a
+        boolean array that is False for boxes that are empty or fully outside
+        of the image boundaries. Crops of these boxes show no image content.
+
+    """
+    bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+    # correct aspect ratio to patch shape
+    target_aspect = float(patch_shape[1]) / patch_shape[0]
+    new_width = target_aspect * bboxes[:, 3]
+    bboxes[:, 0] -= (new_width - bboxes[:, 2]) / 2
+    bboxes[:, 2] = new_width
+
+    # convert to top left, bottom right
+    bboxes[:, 2:] += bboxes[:, :2]
+    bboxes = bboxes.astype(np.int64)
+
+    # clip at image boundaries
+    image_size = np.asarray(image_shape[:2][::-1])
+    clipped = np.hstack((
+        np.maximum(0, bboxes[:, :2]),
+        np.minimum(image_size - 1, bboxes[:, 2:])))
+    valid = np.all(clipped[:, :2] < clipped[:, 2:], axis=1)
+    # crops of invalid boxes sample outside of the image only
+    bboxes = np.where(valid[:, np.newaxis], clipped, -1)
+
+    # pixel coordinates of the first and last row/column of every crop,
+    # normalized such that 0 and 1 map to the image borders
+    scale = np.maximum(image_size - 1, 1).astype(np.float64)
+    x1, y1 = bboxes[:, 0] / scale[0], bboxes[:, 1] / scale[1]
+    x2, y2 = (bboxes[:, 2] - 1) / scale[0], (bboxes[:, 3] - 1) / scale[1]
+    return np.stack((y1, x1, y2, x2), axis=1).astype(np.float32), valid
+
+
+# Batch sizes the encoder network is run with. Inputs are zero-padded to the
+# next bucket so that every call hits one of a few fixed shapes.
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _wrap_frozen_graph(graph_def, input_name, output_name):
+    """Import a frozen graph and prune it to a concrete function that maps
+    the input tensor to the output tensor.
+    """
+    def import_graph_def():
+        tf.compat.v1.import_graph_def(graph_def, name="net")
+
+    wrapped = tf.compat.v1.wrap_function(import_graph_def, [])
+    graph = wrapped.graph
+    return wrapped.prune(
+        graph.as_graph_element("%s:0" % input_name),
+        graph.as_graph_element("%s:0" % output_name))
+
+
 class ImageEncoder(object):
+    """
+    TF2 wrapper around a frozen appearance descriptor graph.
 
-    def __init__(self, checkpoint_filename, input_name="images",
-                 output_name="features"):
-        self.session = tf.Session()
-        with tf.gfile.GFile(checkpoint_filename, "rb") as file_handle:
-            graph_def = tf.GraphDef()
-            graph_def.ParseFromString(file_handle.read())
-        tf.import_graph_def(graph_def, name="net")
-        self.input_var = tf.get_default_graph().get_tensor_by_name(
-            "%s:0" % input_name)
-        self.output_var = tf.get_default_graph().get_tensor_by_name(
-            "%s:0" % output_name)
+    The frozen graph is wrapped as a concrete function once. Crop and resize
+    of image patches runs in a `tf.function` in front of it, so a frame and
+    all of its boxes are encoded in a single call. The crops are sampled
+    bilinearly on the box grid with `tf.image.crop_and_resize`, which
+    differs slightly from the `cv2.resize` of `extract_image_patch`, so the
+    features are not bitwise identical to those of host-side patches. Every call is padded to
+    the next of `batch_buckets`, which keeps the number of distinct input
+    shapes small and avoids retracing.
 
-        assert len(self.output_var.get_shape()) == 2
-        assert len(self.input_var.get_shape()) == 4
-        self.feature_dim = self.output_var.get_shape().as_list()[-1]
-        self.image_shape = self.input_var.get_shape().as_list()[1:]
+    Parameters
+    ----------
+    checkpoint_filename : str
+        Path to the frozen inference graph protobuf.
+    input_name : str
+        Name of the input tensor (uint8 image patches).
+    output_name : str
+        Name of the output tensor (features).
+    batch_buckets : Tuple[int]
+        Sorted batch sizes that inputs are padded to.
 
-    def __call__(self, data_x, batch_size=32):
-        out = np.zeros((len(data_x), self.feature_dim), np.float32)
+    """
+
+    def __init__(self, checkpoint_filename, input_name="images",
+                 output_name="features", batch_buckets=BATCH_BUCKETS):
+        with tf.io.gfile.GFile(checkpoint_filename, "rb") as file_handle:
+            graph_def = tf.compat.v1.GraphDef()
+            graph_def.ParseFromString(file_handle.read())
+        self._network = _wrap_frozen_graph(graph_def, input_name, output_name)
+        self.batch_buckets = tuple(sorted(batch_buckets))
+
+        input_shape = self._network.inputs[0].shape.as_list()
+        output_shape = self._network.outputs[0].shape.as_list()
+        assert len(output_shape) == 2
+        assert len(input_shape) == 4
+        self.feature_dim = output_shape[-1]
+        self.image_shape = input_shape[1:]
+
+        patch_spec = tf.TensorSpec([None] + self.image_shape, tf.uint8)
+        self._encode_patches = tf.function(
+            self._network, input_signature=[patch_spec])
+        image_spec = [
+            tf.TensorSpec([None, None, 3], tf.uint8),
+            tf.TensorSpec([None, 4], tf.float32)]
+        self._crop_patches = tf.function(
+            self._crop, input_signature=image_spec)
+        self._encode_boxes = tf.function(
+            lambda image, boxes: self._network(self._crop(image, boxes)),
+            input_signature=image_spec)
+
+    def _crop(self, image, boxes):
+        patches = tf.image.crop_and_resize(
+            tf.cast(image, tf.float32)[tf.newaxis], boxes,
+            tf.zeros_like(boxes[:, 0], tf.int32), self.image_shape[:2],
+            method="bilinear")
+        return tf.cast(tf.round(patches), tf.uint8)
+
+    def bucket_size(self, batch_size):
+        """Returns the batch size that a batch of the given size is padded
+        to.
+        """
+        return next(
+            (b for b in self.batch_buckets if b >= batch_size), batch_size)
+
+    def _pad(self, data):
+        """Zero-pad the first axis of `data` to the next batch bucket."""
+        size = self.bucket_size(len(data))
+        if size == len(data):
+            return data
+        padding = np.zeros((size - len(data), ) + data.shape[1:], data.dtype)
+        return np.concatenate((data, padding))
+
+    def _run(self, f, data, batch_size):
+        out = np.zeros((len(data), self.feature_dim), np.float32)
         _run_in_batches(
-            lambda x: self.session.run(self.output_var, feed_dict=x),
-            {self.input_var: data_x}, out, batch_size)
+            lambda x: f(self._pad(x["data"]))[:len(x["data"])],
+            {"data": data}, out, batch_size)
         return out
 
+    def __call__(self, data_x, batch_size=32):
+        data_x = np.asarray(data_x, dtype=np.uint8)
+        return self._run(
+            lambda x: self._encode_patches(x).numpy(), data_x, batch_size)
+
+    def encode_boxes(self, image, boxes, batch_size=32):
+        """Crop, resize and encode image patches of a single image.
+
+        Parameters
+        ----------
+        image : ndarray
+            The full image.
+        boxes : ndarray
+            The Nx4 matrix of normalized crop boxes, see `crop_boxes`.
+        batch_size : int
+            The maximum number of patches per network run.
+
+        Returns
+        -------
+        ndarray
+            Returns the NxM matrix of features.
+
+        """
+        image = tf.convert_to_tensor(image, dtype=tf.uint8)
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        return self._run(
+            lambda x: self._encode_boxes(image, x).numpy(), boxes, batch_size)
+
+    def crop_patches(self, image, boxes):
+        """Crop and resize image patches of a single image without encoding
+        them, e.g., to encode patches of several images in one batch.
+
+        Parameters
+        ----------
+        image : ndarray
+            The full image.
+        boxes : ndarray
+            The Nx4 matrix of normalized crop boxes, see `crop_boxes`.
+
+        Returns
+        -------
+        ndarray
+            Returns the uint8 image patches of shape N x `image_shape`.
+
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        return self._crop_patches(
+            tf.convert_to_tensor(image, dtype=tf.uint8), boxes).numpy()
+
 
 def create_box_encoder(model_filename, input_name="images",
-                       output_name="features", batch_size=32):
+                       output_name="features", batch_size=32, cv2_crop=False):
     image_encoder = ImageEncoder(model_filename, input_name, output_name)
     image_shape = image_encoder.image_shape
 
     def encoder(image, boxes):
-        image_patches = []
-        for box in boxes:
-            patch = extract_image_patch(image, box, image_shape[:2])
-            if patch is None:
-                print("WARNING: Failed to extract image patch: %s." % str(box))
-                patch = np.random.uniform(
-                    0., 255., image_shape).astype(np.uint8)
-            image_patches.append(patch)
-        image_patches = np.asarray(image_patches)
-        return image_encoder(image_patches, batch_size)
+        if cv2_crop:
+            # crop on the host like the original deep_sort encoder
+            patches = extract_image_patches(image, boxes, image_shape)
+            return image_encoder(patches, batch_size)
+        normalized_boxes, valid = crop_boxes(
+            image.shape, boxes, image_shape[:2])
+        for box in np.asarray(boxes)[~valid]:
+            print("WARNING: Failed to extract image patch: %s." % str(box))
+        return image_encoder.encode_boxes(image, normalized_boxes, batch_size)
 
     return encoder
 
 
-def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
+def _prefetch(f, items, prefetch):
+    """Yield `f(item)` for all items in order, computing up to `prefetch`
+    results ahead of time in a thread pool. Runs sequentially if `prefetch`
+    is 0.
+    """
+    if prefetch <= 0:
+        for item in items:
+            yield f(item)
+        return
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        futures = collections.deque()
+        for item in items:
+            futures.append(executor.submit(f, item))
+            if len(futures) > prefetch:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def group_by_frame(frame_indices):
+    """Group detection rows by frame index in one pass.
+
+    Parameters
+    ----------
+    frame_indices : ndarray
+        The frame index of every detection row.
+
+    Returns
+    -------
+    (ndarray, ndarray, ndarray)
+        Returns the row order that sorts detections by frame (stable within
+        a frame), the sorted unique frame indices and the offsets into the
+        row order where each frame starts, with a final entry equal to the
+        number of rows.
+
+    """
+    order = np.argsort(frame_indices, kind="stable")
+    frames, starts = np.unique(frame_indices[order], return_index=True)
+    return order, frames, np.r_[starts, len(order)]
+
+
+def _makedirs(output_dir):
+    try:
+        os.makedirs(output_dir)
+    except OSError as exception:
+        if exception.errno == errno.EEXIST and os.path.isdir(output_dir):
+            pass
+        else:
+            raise ValueError(
+                "Failed to created output directory '%s'" % output_dir)
+
+
+OUTPUT_FORMATS = ("npy", "store")
+
+
+class _NpyWriter(object):
+    """Collects detections with features in a preallocated array and saves
+    them to a single .npy file on close.
+    """
+
+    def __init__(self, filename, capacity, row_dim, feature_dim):
+        self.filename = filename
+        self._detections = np.zeros((capacity, row_dim + feature_dim))
+        self._row_dim = row_dim
+        self._num_rows = 0
+
+    def append(self, frame_idx, rows, features):
+        end = self._num_rows + len(rows)
+        self._detections[self._num_rows:end, :self._row_dim] = rows
+        self._detections[self._num_rows:end, self._row_dim:] = features
+        self._num_rows = end
+
+    def close(self):
+        np.save(
+            self.filename, self._detections[:self._num_rows],
+            allow_pickle=False)
+
+
+def generate_sequence_detections(encoder, sequence_dir, detection_file,
+                                 output_filename, prefetch=0,
+                                 output_format="npy"):
+    """Generate detections with features for a single sequence.
+
+    Parameters
+    ----------
+    encoder : Callable[image, ndarray] -> ndarray
+        The encoder function, see `generate_detections`.
+    sequence_dir : str
+        Path to the MOTChallenge sequence directory.
+    detection_file : str
+        Path to the detection file in MOTChallenge format.
+    output_filename : str
+        Path to the output .npy file or detection store directory.
+    prefetch : int
+        Number of images that are read ahead of time in background threads.
+    output_format : str
+        Either "npy" to write one dense array of detection rows followed by
+        features, or "store" to write a memory-mapped, frame-indexed
+        `detection_store.DetectionStore`.
+
+    """
+    writer_cls = DetectionStoreWriter if output_format == "store" \
+        else _NpyWriter
+    image_dir = os.path.join(sequence_dir, "img1")
+    image_filenames = {
+        int(os.path.splitext(f)[0]): os.path.join(image_dir, f)
+        for f in os.listdir(image_dir)}
+
+    detections_in = np.loadtxt(detection_file, delimiter=',', ndmin=2)
+    order, frames, offsets = group_by_frame(
+        detections_in[:, 0].astype(np.int64))
+    max_frame_idx = frames.max() if len(frames) > 0 else 0
+    for frame_idx in frames:
+        if frame_idx not in image_filenames:
+            print("WARNING could not find image for frame %d" % frame_idx)
+    available = np.asarray(
+        [frame_idx in image_filenames for frame_idx in frames], dtype=bool)
+
+    # Rows are written in frame order into preallocated output arrays. The
+    # feature dimension is known once the first features have been computed.
+    writer = None
+    images = _prefetch(
+        lambda frame_idx: cv2.imread(
+            image_filenames[frame_idx], cv2.IMREAD_COLOR),
+        frames[available].tolist(), prefetch)
+    for k, bgr_image in zip(np.flatnonzero(available), images):
+        print("Frame %05d/%05d" % (frames[k], max_frame_idx))
+        rows = detections_in[order[offsets[k]:offsets[k + 1]]]
+        features = encoder(bgr_image, rows[:, 2:6].copy())
+        if writer is None:
+            writer = writer_cls(
+                output_filename, len(detections_in), rows.shape[1],
+                features.shape[1])
+        writer.append(frames[k], rows, features)
+
+    if writer is None:
+        writer = writer_cls(output_filename, 0, detections_in.shape[1], 0)
+    writer.close()
+
+
+def _sequence_jobs(mot_dir, output_dir, detection_dir, output_format):
+    if detection_dir is None:
+        detection_dir = mot_dir
+    _makedirs(output_dir)
+    for sequence in sorted(os.listdir(mot_dir)):
+        yield (
+            sequence, os.path.join(mot_dir, sequence),
+            os.path.join(detection_dir, sequence, "det/det.txt"),
+            os.path.join(output_dir, sequence if output_format == "store"
+                         else "%s.npy" % sequence))
+
+
+def generate_detections(encoder, mot_dir, output_dir, detection_dir=None,
+                        prefetch=0, output_format="npy"):
     """Generate detections with features.
 
     Parameters
@@ -137,53 +502,76 @@ def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
         Path to custom detections. The directory structure should be the default
         MOTChallenge structure: `[sequence]/det/det.txt`. If None, uses the
         standard MOTChallenge detections.
+    prefetch : int
+        Number of images that are read ahead of time in background threads.
+    output_format : str
+        Either "npy" to write one `[sequence].npy` file per sequence or
+        "store" to write one detection store directory `[sequence]` per
+        sequence, see `generate_sequence_detections`.
 
     """
-    if detection_dir is None:
-        detection_dir = mot_dir
-    try:
-        os.makedirs(output_dir)
-    except OSError as exception:
-        if exception.errno == errno.EEXIST and os.path.isdir(output_dir):
-            pass
-        else:
-            raise ValueError(
-                "Failed to created output directory '%s'" % output_dir)
-
-    for sequence in os.listdir(mot_dir):
+    for sequence, sequence_dir, detection_file, output_filename in \
+            _sequence_jobs(mot_dir, output_dir, detection_dir, output_format):
         print("Processing %s" % sequence)
-        sequence_dir = os.path.join(mot_dir, sequence)
-
-        image_dir = os.path.join(sequence_dir, "img1")
-        image_filenames = {
-            int(os.path.splitext(f)[0]): os.path.join(image_dir, f)
-            for f in os.listdir(image_dir)}
-
-        detection_file = os.path.join(
-            detection_dir, sequence, "det/det.txt")
-        detections_in = np.loadtxt(detection_file, delimiter=',')
-        detections_out = []
-
-        frame_indices = detections_in[:, 0].astype(np.int)
-        min_frame_idx = frame_indices.astype(np.int).min()
-        max_frame_idx = frame_indices.astype(np.int).max()
-        for frame_idx in range(min_frame_idx, max_frame_idx + 1):
-            print("Frame %05d/%05d" % (frame_idx, max_frame_idx))
-            mask = frame_indices == frame_idx
-            rows = detections_in[mask]
-
-            if frame_idx not in image_filenames:
-                print("WARNING could not find image for frame %d" % frame_idx)
-                continue
-            bgr_image = cv2.imread(
-                image_filenames[frame_idx], cv2.IMREAD_COLOR)
-            features = encoder(bgr_image, rows[:, 2:6].copy())
-            detections_out += [np.r_[(row, feature)] for row, feature
-                               in zip(rows, features)]
-
-        output_filename = os.path.join(output_dir, "%s.npy" % sequence)
-        np.save(
-            output_filename, np.asarray(detections_out), allow_pickle=False)
+        generate_sequence_detections(
+            encoder, sequence_dir, detection_file, output_filename, prefetch,
+            output_format)
+
+
+# The encoder of a worker process of `generate_detections_parallel`.
+_worker_encoder = None
+
+
+def _init_worker(model_filename, batch_size, cv2_crop):
+    global _worker_encoder
+    _worker_encoder = create_box_encoder(
+        model_filename, batch_size=batch_size, cv2_crop=cv2_crop)
+
+
+def _run_worker(job, prefetch, output_format):
+    sequence, sequence_dir, detection_file, output_filename = job
+    print("Processing %s" % sequence)
+    generate_sequence_detections(
+        _worker_encoder, sequence_dir, detection_file, output_filename,
+        prefetch, output_format)
+    return sequence
+
+
+def generate_detections_parallel(model_filename, mot_dir, output_dir,
+                                 detection_dir=None, workers=1, prefetch=0,
+                                 batch_size=32, output_format="npy",
+                                 cv2_crop=False):
+    """Generate detections with features, processing sequences in parallel.
+
+    Every worker process loads its own encoder from `model_filename` and
+    processes one sequence at a time. See `generate_detections` for the
+    remaining parameters.
+
+    Parameters
+    ----------
+    model_filename : str
+        Path to the frozen inference graph protobuf of the encoder.
+    workers : int
+        Number of worker processes.
+    batch_size : int
+        Batch size of the encoder in every worker.
+    cv2_crop : bool
+        If True, image patches are cropped on the host with OpenCV, see
+        `create_box_encoder`.
+
+    """
+    jobs = list(_sequence_jobs(
+        mot_dir, output_dir, detection_dir, output_format))
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+            max_workers=workers, mp_context=context,
+            initializer=_init_worker,
+            initargs=(model_filename, batch_size, cv2_crop)) as executor:
+        futures = [
+            executor.submit(_run_worker, job, prefetch, output_format)
+            for job in jobs]
+        for future in as_completed(futures):
+            print("Finished %s" % future.result())
 
 
 def parse_args():
@@ -204,14 +592,35 @@ def parse_args():
     parser.add_argument(
         "--output_dir", help="Output directory. Will be created if it does not"
         " exist.", default="detections")
+    parser.add_argument(
+        "--workers", help="Number of processes that work on different "
+        "sequences in parallel.", type=int, default=1)
+    parser.add_argument(
+        "--prefetch", help="Number of images that are read ahead of time in "
+        "background threads.", type=int, default=4)
+    parser.add_argument(
+        "--format", help="Output format: one .npy file per sequence or one "
+        "memory-mapped, frame-indexed detection store directory per "
+        "sequence.", choices=OUTPUT_FORMATS, default="npy")
+    parser.add_argument(
+        "--cv2_crop", help="Crop image patches on the host with OpenCV, as "
+        "the original encoder did, instead of on the encoder graph. Use this "
+        "to reproduce features of earlier runs.", action="store_true")
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
-    encoder = create_box_encoder(args.model, batch_size=32)
+    if args.workers > 1:
+        generate_detections_parallel(
+            args.model, args.mot_dir, args.output_dir, args.detection_dir,
+            args.workers, args.prefetch, output_format=args.format,
+            cv2_crop=args.cv2_crop)
+        return
+    encoder = create_box_encoder(
+        args.model, batch_size=32, cv2_crop=args.cv2_crop)
     generate_detections(encoder, args.mot_dir, args.output_dir,
-                        args.detection_dir)
+                        args.detection_dir, args.prefetch, args.format)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+# vim: expandtab:ts=4:sw=4
+import collections
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+
+# Counts that are summed over sequences before metrics are computed.
+COUNT_KEYS = (
+    "num_frames", "num_gt", "num_hyp", "tp", "fp", "fn", "id_switches",
+    "idtp")
+
+
+def load_ground_truth(filename):
+    """Load a MOTChallenge ground truth file.
+
+    Only rows that are marked for evaluation are kept. In the 9 column format
+    of MOT16/17, only pedestrians (class 1) are kept as well.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the gt.txt file.
+
+    Returns
+    -------
+    ndarray
+        An Nx6 matrix of rows `(frame, id, x, y, w, h)`.
+
+    """
+    data = np.loadtxt(filename, delimiter=",", ndmin=2)
+    keep = np.ones(len(data), dtype=bool)
+    if data.shape[1] > 6:
+        keep &= data[:, 6] != 0
+    if data.shape[1] == 9:
+        keep &= data[:, 7] == 1
+    return data[keep, :6]
+
+
+def iou_matrix(boxes, candidates):
+    """Computes the intersection over union between all pairs of boxes.
+
+    Parameters
+    ----------
+    boxes : ndarray
+        An Nx4 matrix of bounding boxes in format `(x, y, w, h)`.
+    candidates : ndarray
+        An Mx4 matrix of bounding boxes in the same format.
+
+    Returns
+    -------
+    ndarray
+        The NxM matrix of intersection over union.
+
+    """
+    boxes_tl, boxes_br = boxes[:, :2], boxes[:, :2] + boxes[:, 2:]
+    candidates_tl = candidates[:, :2]
+    candidates_br = candidates[:, :2] + candidates[:, 2:]
+    tl = np.maximum(boxes_tl[:, np.newaxis], candidates_tl[np.newaxis])
+    br = np.minimum(boxes_br[:, np.newaxis], candidates_br[np.newaxis])
+    area_intersection = np.maximum(0., br - tl).prod(axis=2)
+    area_union = (
+        boxes[:, 2:].prod(axis=1)[:, np.newaxis] +
+        candidates[:, 2:].prod(axis=1)[np.newaxis] - area_intersection)
+    return area_intersection / np.maximum(area_union, 1e-12)
+
+
+class MOTAccumulator(object):
+    """
+    Accumulates the CLEAR MOT and identity counts of one sequence, frame by
+    frame.
+
+    In every frame, ground truth objects keep their hypothesis of the previous
+    frame if the boxes still overlap; the remaining objects are matched to the
+    remaining hypotheses by minimum cost assignment on 1 - IoU. A ground truth
+    object that is matched to a different hypothesis than the last time
+    counts as an identity switch. For IDF1, the number of frames every ground
+    truth/hypothesis trajectory pair overlaps is counted; trajectories are
+    matched one-to-one when the counts are read.
+
+    Parameters
+    ----------
+    iou_threshold : float
+        Minimum intersection over union of a match.
+
+    """
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self.num_frames = 0
+        self.num_gt = 0
+        self.num_hyp = 0
+        self.tp = 0
+        self.id_switches = 0
+        self._last_match = {}
+        self._last_object = {}
+        self._pair_frames = collections.Counter()
+
+    def update(self, gt_ids, gt_boxes, hyp_ids, hyp_boxes):
+        """Add the objects and hypotheses of a single frame.
+
+        Parameters
+        ----------
+        gt_ids : array_like
+            The N ground truth identifiers.
+        gt_boxes : array_like
+            The Nx4 ground truth boxes in format `(x, y, w, h)`.
+        hyp_ids : array_like
+            The M hypothesis (track) identifiers.
+        hyp_boxes : array_like
+            The Mx4 hypothesis boxes in format `(x, y, w, h)`.
+
+        """
+        gt_ids = np.asarray(gt_ids, dtype=np.int64)
+        hyp_ids = np.asarray(hyp_ids, dtype=np.int64)
+        self.num_frames += 1
+        self.num_gt += len(gt_ids)
+        self.num_hyp += len(hyp_ids)
+        if len(gt_ids) == 0 or len(hyp_ids) == 0:
+            return
+
+        iou = iou_matrix(
+            np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4),
+            np.asarray(hyp_boxes, dtype=np.float64).reshape(-1, 4))
+        valid = iou >= self.iou_threshold
+        rows, cols = np.nonzero(valid)
+        self._pair_frames.update(zip(gt_ids[rows], hyp_ids[cols]))
+
+        # Keep the correspondences of the previous frame.
+        hyp_index = {hyp_id: j for j, hyp_id in enumerate(hyp_ids)}
+        matches = []
+        matched_rows, matched_cols = set(), set()
+        for i, gt_id in enumerate(gt_ids):
+            j = hyp_index.get(self._last_match.get(gt_id))
+            if j is not None and j not in matched_cols and valid[i, j]:
+                matches.append((i, j))
+                matched_rows.add(i)
+                matched_cols.add(j)
+
+        # Match the remaining objects by minimum cost assignment.
+        remaining_rows = [
+            i for i in range(len(gt_ids)) if i not in matched_rows]
+        remaining_cols = [
+            j for j in range(len(hyp_ids)) if j not in matched_cols]
+        if len(remaining_rows) > 0 and len(remaining_cols) > 0:
+            cost = np.where(valid, 1. - iou, 2.)[
+                np.ix_(remaining_rows, remaining_cols)]
+            for row, col in zip(*linear_sum_assignment(cost)):
+                i, j = remaining_rows[row], remaining_cols[col]
+                if not valid[i, j]:
+                    continue
+                last = self._last_match.get(gt_ids[i])
+                if last is not None and last != hyp_ids[j]:
+                    self.id_switches += 1
+                matches.append((i, j))
+
+        for i, j in matches:
+            gt_id, hyp_id = gt_ids[i], hyp_ids[j]
+            # A hypothesis corresponds to one object at a time; drop the
+            # correspondence of the object it has been taken from.
+            previous_gt_id = self._last_object.get(hyp_id)
+            if previous_gt_id is not None and previous_gt_id != gt_id and \
+                    self._last_match.get(previous_gt_id) == hyp_id:
+                del self._last_match[previous_gt_id]
+            self._last_match[gt_id] = hyp_id
+            self._last_object[hyp_id] = gt_id
+        self.tp += len(matches)
+
+    def counts(self):
+        """Returns the accumulated counts, see `COUNT_KEYS`."""
+        idtp = 0
+        if len(self._pair_frames) > 0:
+            gt_ids = sorted(set(gt_id for gt_id, _ in self._pair_frames))
+            hyp_ids = sorted(set(hyp_id for _, hyp_id in self._pair_frames))
+            gt_index = {gt_id: i for i, gt_id in enumerate(gt_ids)}
+            hyp_index = {hyp_id: j for j, hyp_id in enumerate(hyp_ids)}
+            overlap = np.zeros((len(gt_ids), len(hyp_ids)))
+            for (gt_id, hyp_id), num_frames in self._pair_frames.items():
+                overlap[gt_index[gt_id], hyp_index[hyp_id]] = num_frames
+            rows, cols = linear_sum_assignment(-overlap)
+            idtp = int(overlap[rows, cols].sum())
+        return {
+            "num_frames": self.num_frames, "num_gt": self.num_gt,
+            "num_hyp": self.num_hyp, "tp": self.tp,
+            "fp": self.num_hyp - self.tp, "fn": self.num_gt - self.tp,
+            "id_switches": self.id_switches, "idtp": idtp}
+
+
+def evaluate(gt_rows, hyp_rows, iou_threshold=0.5):
+    """Compute the counts of a sequence.
+
+    Parameters
+    ----------
+    gt_rows : ndarray
+        Ground truth rows in MOTChallenge format `(frame, id, x, y, w, h)`.
+    hyp_rows : ndarray
+        Tracking results in the same format.
+    iou_threshold : float
+        Minimum intersection over union of a match.
+
+    Returns
+    -------
+    Dict[str, int]
+        The counts, see `COUNT_KEYS`.
+
+    """
+    accumulator = MOTAccumulator(iou_threshold)
+    gt_rows = gt_rows[np.argsort(gt_rows[:, 0], kind="stable")]
+    hyp_rows = hyp_rows[np.argsort(hyp_rows[:, 0], kind="stable")]
+    frames = np.union1d(gt_rows[:, 0], hyp_rows[:, 0])
+    gt_offsets = np.searchsorted(gt_rows[:, 0], frames, side="left")
+    gt_ends = np.searchsorted(gt_rows[:, 0], frames, side="right")
+    hyp_offsets = np.searchsorted(hyp_rows[:, 0], frames, side="left")
+    hyp_ends = np.searchsorted(hyp_rows[:, 0], frames, side="right")
+    for k in range(len(frames)):
+        gt = gt_rows[gt_offsets[k]:gt_ends[k]]
+        hyp = hyp_rows[hyp_offsets[k]:hyp_ends[k]]
+        accumulator.update(gt[:, 1], gt[:, 2:6], hyp[:, 1], hyp[:, 2:6])
+    return accumulator.counts()
+
+
+def summarize(counts):
+    """Sum the counts of several sequences and compute the metrics.
+
+    Parameters
+    ----------
+    counts : List[Dict[str, int]]
+        The counts of every sequence.
+
+    Returns
+    -------
+    Dict[str, float]
+        The summed counts together with MOTA, IDF1, precision and recall.
+
+    """
+    total = {key: sum(c[key] for c in counts) for key in COUNT_KEYS}
+    num_gt, num_hyp = total["num_gt"], total["num_hyp"]
+    total["mota"] = 1. - float(
+        total["fn"] + total["fp"] + total["id_switches"]) / max(num_gt, 1)
+    total["idf1"] = 2. * total["idtp"] / max(num_gt + num_hyp, 1)
+    total["precision"] = float(total["tp"]) / max(num_hyp, 1)
+    total["recall"] = float(total["tp"]) / max(num_gt, 1)
+    return total
@@ -0,0 +1,334 @@
+# vim: expandtab:ts=4:sw=4
+import os
+import time
+import argparse
+import configparser
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from deep_sort import nn_matching
+from deep_sort.detection import Detection
+from deep_sort.tracker import Tracker
+from tools.detection_store import DetectionStore, is_detection_store
+from tools.track_writer import TrackWriter
+
+
+def load_detections(path):
+    """Memory-map the detections of a sequence.
+
+    Parameters
+    ----------
+    path : str
+        Path to a .npy file written by `generate_detections` or to a
+        `detection_store.DetectionStore` directory.
+
+    Returns
+    -------
+    (ndarray, ndarray, ndarray)
+        Returns the detection rows in MOTChallenge format, the appearance
+        features and the frame index: the detections of frame k are stored
+        in rows `offsets[k]` to `offsets[k + 1]`. Rows and features are
+        read-only views that processes mapping the same file share.
+
+    """
+    if is_detection_store(path):
+        store = DetectionStore(path)
+        return store.rows, store.features, store.offsets
+    data = np.load(path, mmap_mode="r")
+    frame_indices = data[:, 0].astype(np.int64)
+    if np.any(frame_indices[1:] < frame_indices[:-1]):
+        order = np.argsort(frame_indices, kind="stable")
+        data, frame_indices = data[order], frame_indices[order]
+    num_frames = frame_indices[-1] + 1 if len(frame_indices) > 0 else 0
+    offsets = np.searchsorted(frame_indices, np.arange(num_frames + 1))
+    return data[:, :10], data[:, 10:], offsets
+
+
+def detection_path(detection_dir, sequence):
+    """Returns the path to the detections of a sequence: a detection store
+    directory if there is one, the .npy file otherwise.
+    """
+    path = os.path.join(detection_dir, sequence)
+    if is_detection_store(path):
+        return path
+    return os.path.join(detection_dir, "%s.npy" % sequence)
+
+
+def sequence_length(sequence_dir, offsets, gt_rows=None):
+    """Returns the number of frames of a sequence, read from seqinfo.ini if
+    available. Otherwise, the last frame with detections or ground truth
+    ends the sequence.
+    """
+    info_filename = os.path.join(sequence_dir, "seqinfo.ini")
+    if os.path.isfile(info_filename):
+        parser = configparser.ConfigParser()
+        parser.read(info_filename)
+        if parser.has_option("Sequence", "seqLength"):
+            return parser.getint("Sequence", "seqLength")
+    num_frames = len(offsets) - 2
+    if gt_rows is not None and len(gt_rows) > 0:
+        num_frames = max(num_frames, int(gt_rows[:, 0].max()))
+    return num_frames
+
+
+def create_tracker(config):
+    """Create a tracker with cosine appearance metric.
+
+    Parameters
+    ----------
+    config : Dict[str, object]
+        The tracker parameters `max_cosine_distance`, `nn_budget`,
+        `max_iou_distance`, `max_age` and `n_init`.
+
+    """
+    metric = nn_matching.NearestNeighborDistanceMetric(
+        "cosine", config["max_cosine_distance"], config["nn_budget"])
+    return Tracker(
+        metric, max_iou_distance=config["max_iou_distance"],
+        max_age=config["max_age"], n_init=config["n_init"])
+
+
+def iterate_frames(rows, features, offsets, num_frames, min_confidence=0.8,
+                   min_detection_height=0):
+    """Stream the stored detections of a sequence frame by frame.
+
+    Parameters
+    ----------
+    rows : ndarray
+        Detection rows in MOTChallenge format.
+    features : ndarray
+        The appearance features, one per row.
+    offsets : ndarray
+        The frame index of the rows, see `load_detections`.
+    num_frames : int
+        Number of frames; frames are indexed from 1 to `num_frames`.
+    min_confidence : float
+        Detections with a lower confidence are disregarded.
+    min_detection_height : int
+        Detections with a smaller height are disregarded.
+
+    Returns
+    -------
+    Iterator[(int, List[deep_sort.detection.Detection])]
+        Yields the frame index and the detections of every frame, including
+        frames without detections.
+
+    """
+    for frame_idx in range(1, num_frames + 1):
+        start, end = 0, 0
+        if frame_idx + 1 < len(offsets):
+            start, end = offsets[frame_idx], offsets[frame_idx + 1]
+        frame_rows = rows[start:end]
+        keep = np.flatnonzero(
+            (frame_rows[:, 6] >= min_confidence) &
+            (frame_rows[:, 5] >= min_detection_height))
+        yield frame_idx, [
+            Detection(frame_rows[i, 2:6], frame_rows[i, 6], None,
+                      features[start + i]) for i in keep]
+
+
+def run_tracker(rows, features, offsets, num_frames, config,
+                min_confidence=0.8, min_detection_height=0):
+    """Track the stored detections of a sequence in memory.
+
+    See `iterate_frames` for the parameters and `create_tracker` for the
+    tracker configuration.
+
+    Returns
+    -------
+    ndarray
+        The tracking results as an Nx6 matrix of rows
+        `(frame, track_id, x, y, w, h)`, holding the confirmed tracks that
+        have been updated in a frame.
+
+    """
+    tracker = create_tracker(config)
+    results = []
+    for frame_idx, detections in iterate_frames(
+            rows, features, offsets, num_frames, min_confidence,
+            min_detection_height):
+        tracker.predict()
+        tracker.update(detections)
+        for track in tracker.tracks:
+            if not track.is_confirmed() or track.time_since_update > 1:
+                continue
+            results.append([frame_idx, track.track_id] + list(track.to_tlwh()))
+    return np.asarray(results, dtype=np.float64).reshape(-1, 6)
+
+
+def run_sequence(sequence_dir, detection_file, output_file, config,
+                 min_confidence=0.8, min_detection_height=0):
+    """Track the stored detections of a sequence and write the results in
+    MOTChallenge format.
+
+    Parameters
+    ----------
+    sequence_dir : str
+        Path to the MOTChallenge sequence directory, used to read the
+        sequence length.
+    detection_file : str
+        Path to the .npy file or detection store of the sequence.
+    output_file : str
+        Path to the tracking output file.
+    config : Dict[str, object]
+        The tracker configuration, see `create_tracker`.
+    min_confidence : float
+        Detections with a lower confidence are disregarded.
+    min_detection_height : int
+        Detections with a smaller height are disregarded.
+
+    Returns
+    -------
+    (int, float)
+        Returns the number of frames and the time in seconds spent tracking.
+
+    """
+    rows, features, offsets = load_detections(detection_file)
+    num_frames = sequence_length(sequence_dir, offsets)
+    tracker = create_tracker(config)
+    start = time.time()
+    with TrackWriter(output_file, "mot") as writer:
+        for frame_idx, detections in iterate_frames(
+                rows, features, offsets, num_frames, min_confidence,
+                min_detection_height):
+            tracker.predict()
+            tracker.update(detections)
+            writer.write(frame_idx, tracker.tracks)
+    return num_frames, time.time() - start
+
+
+def _makedirs(output_dir):
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+
+def _sequence_jobs(mot_dir, detection_dir, output_dir):
+    _makedirs(output_dir)
+    for sequence in sorted(os.listdir(mot_dir)):
+        path = detection_path(detection_dir, sequence)
+        if not os.path.exists(path):
+            print("WARNING skipping %s, no detections" % sequence)
+            continue
+        yield (
+            sequence, os.path.join(mot_dir, sequence), path,
+            os.path.join(output_dir, "%s.txt" % sequence))
+
+
+def _run_worker(job, config, min_confidence, min_detection_height):
+    sequence, sequence_dir, detection_file, output_file = job
+    num_frames, elapsed = run_sequence(
+        sequence_dir, detection_file, output_file, config, min_confidence,
+        min_detection_height)
+    return sequence, num_frames, elapsed
+
+
+def run(mot_dir, detection_dir, output_dir, config, min_confidence=0.8,
+        min_detection_height=0, workers=1):
+    """Track all sequences of a MOTChallenge directory, processing sequences
+    in parallel.
+
+    Parameters
+    ----------
+    mot_dir : str
+        Path to the MOTChallenge directory (can be either train or test).
+    detection_dir : str
+        Path to the stored detections, one .npy file or detection store per
+        sequence.
+    output_dir : str
+        Path to the output directory. One MOTChallenge result file is written
+        per sequence. Will be created if it does not exist.
+    config : Dict[str, object]
+        The tracker configuration, see `create_tracker`.
+    min_confidence : float
+        Detections with a lower confidence are disregarded.
+    min_detection_height : int
+        Detections with a smaller height are disregarded.
+    workers : int
+        Number of processes that track different sequences in parallel.
+
+    """
+    jobs = list(_sequence_jobs(mot_dir, detection_dir, output_dir))
+    args = (config, min_confidence, min_detection_height)
+    total_frames, start = 0, time.time()
+
+    def report(sequence, num_frames, elapsed):
+        print("Finished %s: %d frames at %.1f FPS" % (
+            sequence, num_frames, num_frames / max(elapsed, 1e-9)))
+
+    if workers <= 1:
+        for job in jobs:
+            result = _run_worker(job, *args)
+            report(*result)
+            total_frames += result[1]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_worker, job, *args) for job in jobs]
+            for future in as_completed(futures):
+                result = future.result()
+                report(*result)
+                total_frames += result[1]
+    elapsed = time.time() - start
+    print("Tracked %d frames of %d sequences in %.2f s (%.1f FPS)" % (
+        total_frames, len(jobs), elapsed, total_frames / max(elapsed, 1e-9)))
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Offline tracking of stored MOTChallenge detections")
+    parser.add_argument(
+        "--mot_dir", help="Path to MOTChallenge directory (train or test)",
+        required=True)
+    parser.add_argument(
+        "--detection_dir", help="Path to the detections written by "
+        "generate_detections, one .npy file or detection store per sequence",
+        required=True)
+    parser.add_argument(
+        "--output_dir", help="Folder in which the results will be stored. "
+        "Will be created if it does not exist.", default="results")
+    parser.add_argument(
+        "--min_confidence", help="Detection confidence threshold. Disregard "
+        "all detections that have a confidence lower than this value.",
+        default=0.8, type=float)
+    parser.add_argument(
+        "--min_detection_height", help="Threshold on the detection bounding "
+        "box height. Detections with height smaller than this value are "
+        "disregarded", default=0, type=int)
+    parser.add_argument(
+        "--max_cosine_distance", help="Gating threshold for cosine distance "
+        "metric (object appearance).", type=float, default=0.2)
+    parser.add_argument(
+        "--nn_budget", help="Maximum size of the appearance descriptors "
+        "gallery. If None, no budget is enforced.", type=int, default=100)
+    parser.add_argument(
+        "--max_iou_distance", help="Gating threshold of the IoU matching.",
+        type=float, default=0.7)
+    parser.add_argument(
+        "--max_age", help="Number of missed frames before a track is "
+        "deleted.", type=int, default=60)
+    parser.add_argument(
+        "--n_init", help="Number of consecutive detections before a track "
+        "is confirmed.", type=int, default=3)
+    parser.add_argument(
+        "--workers", help="Number of processes that track different "
+        "sequences in parallel.", default=multiprocessing.cpu_count(),
+        type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = {
+        "max_cosine_distance": args.max_cosine_distance,
+        "nn_budget": args.nn_budget, "max_iou_distance": args.max_iou_distance,
+        "max_age": args.max_age, "n_init": args.n_init}
+    run(args.mot_dir, args.detection_dir, args.output_dir, config,
+        args.min_confidence, args.min_detection_height, args.workers)
+
+
+if __name__ == "__main__":
+    main()
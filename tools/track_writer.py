@@ -0,0 +1,101 @@
+# vim: expandtab:ts=4:sw=4
+import csv
+import json
+
+from deep_sort.track import TrackState
+
+
+TRACK_FORMATS = ("jsonl", "csv", "mot")
+
+_STATE_NAMES = {
+    TrackState.Tentative: "tentative",
+    TrackState.Confirmed: "confirmed",
+    TrackState.Deleted: "deleted"}
+
+_CSV_HEADER = [
+    "frame", "track_id", "class", "xmin", "ymin", "xmax", "ymax",
+    "confidence", "state"]
+
+
+class TrackWriter(object):
+    """
+    Buffered writer that streams per-frame track records to a file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the output file.
+    fmt : str
+        One of "jsonl", "csv" or "mot". JSONL and CSV files contain one record
+        `(frame, track_id, class, tlbr, confidence, state)` for every live
+        track. MOT files follow the MOTChallenge result format
+        `frame,id,x,y,w,h,conf,-1,-1,-1` and only contain confirmed tracks
+        that have been updated in the given frame.
+    buffer_size : int
+        Size of the write buffer in bytes.
+
+    """
+
+    def __init__(self, filename, fmt="jsonl", buffer_size=1 << 20):
+        if fmt not in TRACK_FORMATS:
+            raise ValueError(
+                "Invalid track format; must be one of %s" % ", ".join(
+                    TRACK_FORMATS))
+        self.fmt = fmt
+        self._file = open(filename, "w", buffering=buffer_size, newline="")
+        self._csv = None
+        if fmt == "csv":
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(_CSV_HEADER)
+
+    def write(self, frame_idx, tracks):
+        """Write the records of a single frame.
+
+        Parameters
+        ----------
+        frame_idx : int
+            The frame index.
+        tracks : List[deep_sort.track.Track]
+            The tracks of the tracker after the update of this frame.
+
+        """
+        if self.fmt == "mot":
+            for track in tracks:
+                if not track.is_confirmed() or track.time_since_update > 1:
+                    continue
+                x, y, w, h = track.to_tlwh()
+                self._file.write("%d,%d,%.2f,%.2f,%.2f,%.2f,%.4f,-1,-1,-1\n" % (
+                    frame_idx, track.track_id, x, y, w, h,
+                    _confidence(track, 1.)))
+            return
+
+        for track in tracks:
+            if track.is_deleted():
+                continue
+            tlbr = [round(float(v), 2) for v in track.to_tlbr()]
+            confidence = _confidence(track, None)
+            state = _STATE_NAMES[track.state]
+            if self._csv is not None:
+                self._csv.writerow(
+                    [frame_idx, track.track_id, track.get_class()] + tlbr +
+                    ["" if confidence is None else confidence, state])
+            else:
+                self._file.write(json.dumps({
+                    "frame": frame_idx, "track_id": int(track.track_id),
+                    "class": track.get_class(), "tlbr": tlbr,
+                    "confidence": confidence, "state": state}) + "\n")
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _confidence(track, default):
+    if track.confidence is None:
+        return default
+    return round(float(track.confidence), 4)
@@ -0,0 +1,272 @@
+# vim: expandtab:ts=4:sw=4
+import os
+import csv
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from tools.mot_metrics import evaluate, load_ground_truth, summarize
+from tools.offline_tracker import (
+    detection_path, load_detections, run_tracker, sequence_length)
+
+
+# Tracker parameters that are searched over, with their value types.
+PARAMETERS = (
+    ("max_cosine_distance", float), ("nn_budget", int),
+    ("max_iou_distance", float), ("max_age", int), ("n_init", int))
+
+SEARCH_MODES = ("grid", "random")
+
+SORT_KEYS = ("idf1", "mota", "fps")
+
+
+def parse_values(spec, value_type):
+    """Parse the search space of one parameter: either a comma separated
+    list of values or a range `low:high` that random search samples from.
+    The value "none" stands for None (e.g., an unlimited budget).
+    """
+    def parse(value):
+        return None if value.lower() == "none" else value_type(value)
+    if ":" in spec:
+        low, high = spec.split(":")
+        return (value_type(low), value_type(high))
+    return [parse(value) for value in spec.split(",")]
+
+
+def grid_configs(space):
+    """Returns all configurations of the grid spanned by `space`."""
+    names = [name for name, _ in PARAMETERS]
+    for name in names:
+        if isinstance(space[name], tuple):
+            raise ValueError(
+                "Grid search needs a list of values for %s" % name)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*[space[name] for name in names])]
+
+
+def random_configs(space, num_samples, seed=None):
+    """Returns `num_samples` configurations drawn at random from `space`.
+    List values are sampled uniformly, integer ranges inclusively and float
+    ranges uniformly.
+    """
+    rng = np.random.RandomState(seed)
+    configs = []
+    for _ in range(num_samples):
+        config = {}
+        for name, value_type in PARAMETERS:
+            values = space[name]
+            if not isinstance(values, tuple):
+                config[name] = values[rng.randint(len(values))]
+            elif value_type is int:
+                config[name] = int(rng.randint(values[0], values[1] + 1))
+            else:
+                config[name] = float(rng.uniform(values[0], values[1]))
+        configs.append(config)
+    return configs
+
+
+def _sequence_jobs(mot_dir, detection_dir):
+    for sequence in sorted(os.listdir(mot_dir)):
+        sequence_dir = os.path.join(mot_dir, sequence)
+        gt_filename = os.path.join(sequence_dir, "gt", "gt.txt")
+        detection_file = detection_path(detection_dir, sequence)
+        if not os.path.isfile(gt_filename) or \
+                not os.path.exists(detection_file):
+            print("WARNING skipping %s, no ground truth or detections" %
+                  sequence)
+            continue
+        yield sequence, sequence_dir, detection_file, \
+            load_ground_truth(gt_filename)
+
+
+_worker_state = None
+
+
+def _init_worker(jobs, min_confidence, min_detection_height):
+    # Every worker maps the detection files once; the operating system
+    # shares their pages between workers.
+    global _worker_state
+    sequences = []
+    for sequence, sequence_dir, detection_file, gt_rows in jobs:
+        rows, features, offsets = load_detections(detection_file)
+        num_frames = sequence_length(sequence_dir, offsets, gt_rows)
+        sequences.append((rows, features, offsets, num_frames, gt_rows))
+    _worker_state = (sequences, min_confidence, min_detection_height)
+
+
+def _run_worker(config):
+    sequences, min_confidence, min_detection_height = _worker_state
+    counts, num_frames, elapsed = [], 0, 0.
+    for rows, features, offsets, sequence_frames, gt_rows in sequences:
+        start = time.time()
+        results = run_tracker(
+            rows, features, offsets, sequence_frames, config,
+            min_confidence, min_detection_height)
+        elapsed += time.time() - start
+        num_frames += sequence_frames
+        counts.append(evaluate(gt_rows, results))
+    metrics = summarize(counts)
+    metrics["fps"] = num_frames / max(elapsed, 1e-9)
+    return config, metrics
+
+
+def sweep(mot_dir, detection_dir, configs, workers=1, min_confidence=0.8,
+          min_detection_height=0):
+    """Evaluate tracker configurations on all sequences of a MOTChallenge
+    directory.
+
+    Parameters
+    ----------
+    mot_dir : str
+        Path to the MOTChallenge directory with ground truth (train).
+    detection_dir : str
+        Path to the stored detections, one .npy file or detection store per
+        sequence.
+    configs : List[Dict[str, object]]
+        The tracker configurations, see `PARAMETERS`.
+    workers : int
+        Number of processes that evaluate configurations in parallel.
+    min_confidence : float
+        Detections with a lower confidence are disregarded.
+    min_detection_height : int
+        Detections with a smaller height are disregarded.
+
+    Returns
+    -------
+    List[(Dict[str, object], Dict[str, float])]
+        Returns every configuration together with its metrics, summed over
+        all sequences, and its tracking speed in frames per second, in order
+        of completion.
+
+    """
+    jobs = list(_sequence_jobs(mot_dir, detection_dir))
+    initargs = (jobs, min_confidence, min_detection_height)
+    results = []
+
+    def report(config, metrics):
+        print("%s: MOTA %.3f, IDF1 %.3f, %.1f FPS" % (
+            _format_config(config), metrics["mota"], metrics["idf1"],
+            metrics["fps"]))
+        results.append((config, metrics))
+
+    if workers <= 1:
+        _init_worker(*initargs)
+        for config in configs:
+            report(*_run_worker(config))
+        return results
+
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker,
+            initargs=initargs) as executor:
+        futures = [executor.submit(_run_worker, config) for config in configs]
+        for future in as_completed(futures):
+            report(*future.result())
+    return results
+
+
+def _format_config(config):
+    return ", ".join(
+        "%s=%s" % (name, config[name]) for name, _ in PARAMETERS)
+
+
+def write_results(filename, results):
+    """Write the configurations and their metrics to a CSV file."""
+    fieldnames = [name for name, _ in PARAMETERS] + [
+        "mota", "idf1", "precision", "recall", "id_switches", "fp", "fn",
+        "fps"]
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(
+            f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        for config, metrics in results:
+            writer.writerow(dict(config, **metrics))
+
+
+def parse_args():
+    """Parse command line arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Tracker hyper-parameter sweep over stored detections")
+    parser.add_argument(
+        "--mot_dir", help="Path to MOTChallenge directory with ground truth "
+        "(train)", required=True)
+    parser.add_argument(
+        "--detection_dir", help="Path to the detections written by "
+        "generate_detections, one .npy file or detection store per sequence",
+        required=True)
+    parser.add_argument(
+        "--min_confidence", help="Detection confidence threshold. Disregard "
+        "all detections that have a confidence lower than this value.",
+        default=0.8, type=float)
+    parser.add_argument(
+        "--min_detection_height", help="Threshold on the detection bounding "
+        "box height. Detections with height smaller than this value are "
+        "disregarded", default=0, type=int)
+    parser.add_argument(
+        "--max_cosine_distance", help="Gating thresholds for cosine "
+        "distance metric.", default="0.2")
+    parser.add_argument(
+        "--nn_budget", help="Maximum sizes of the appearance descriptors "
+        "gallery, 'none' for no limit.", default="100")
+    parser.add_argument(
+        "--max_iou_distance", help="Gating thresholds of the IoU matching.",
+        default="0.7")
+    parser.add_argument(
+        "--max_age", help="Numbers of missed frames before a track is "
+        "deleted.", default="60")
+    parser.add_argument(
+        "--n_init", help="Numbers of consecutive detections before a track "
+        "is confirmed.", default="3")
+    parser.add_argument(
+        "--search", help="Evaluate the full grid of parameter values, or "
+        "sample configurations at random. Random search also accepts "
+        "ranges low:high.", choices=SEARCH_MODES, default="grid")
+    parser.add_argument(
+        "--num_samples", help="Number of configurations of a random search.",
+        default=20, type=int)
+    parser.add_argument(
+        "--seed", help="Random seed of a random search.", default=None,
+        type=int)
+    parser.add_argument(
+        "--workers", help="Number of processes that evaluate configurations "
+        "in parallel.", default=multiprocessing.cpu_count(), type=int)
+    parser.add_argument(
+        "--sort_by", help="Metric that results are ranked by.",
+        choices=SORT_KEYS, default="idf1")
+    parser.add_argument(
+        "--output_file", help="Path to a CSV file that all results are "
+        "written to.", default=None)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    space = {
+        name: parse_values(getattr(args, name), value_type)
+        for name, value_type in PARAMETERS}
+    if args.search == "grid":
+        configs = grid_configs(space)
+    else:
+        configs = random_configs(space, args.num_samples, args.seed)
+    print("Evaluating %d configurations" % len(configs))
+
+    results = sweep(
+        args.mot_dir, args.detection_dir, configs, args.workers,
+        args.min_confidence, args.min_detection_height)
+    results.sort(key=lambda result: result[1][args.sort_by], reverse=True)
+    print("Best configurations by %s:" % args.sort_by)
+    for config, metrics in results[:10]:
+        print("  %s: MOTA %.3f, IDF1 %.3f, %d ID switches, %.1f FPS" % (
+            _format_config(config), metrics["mota"], metrics["idf1"],
+            metrics["id_switches"], metrics["fps"]))
+    if args.output_file is not None:
+        write_results(args.output_file, results)
+
+
+if __name__ == "__main__":
+    main()